@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Requests per second through auth_middleware, with and without the memo
+of verified tokens, for symmetric (HS256) and asymmetric (RS256, ES256) keys.
+
+Tokens of --users users are sent round-robin, active JTIs are in the local
+JTI cache, so Redis is not needed and only the middleware itself is measured.
+
+Usage: python -m benchmarks.auth_middleware --requests 20000 --algorithm RS256
+"""
+
+import asyncio
+import os
+from argparse import ArgumentParser
+from json import dumps
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from chat.middlewares import auth
+from chat.middlewares.auth import (
+    TokenKeys,
+    auth_middleware,
+    get_jti,
+    get_token,
+    jti_cache,
+    verified_tokens,
+)
+
+
+def generate_keys(algorithm: str, directory: str) -> tuple:
+    """
+    Generate PEM key pair for the asymmetric algorithm
+    :param algorithm: "RS256" or "ES256"
+    :param directory: directory to write the key files to
+    :return: (private key file, public key file)
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    if algorithm.startswith("RS"):
+        key = rsa.generate_private_key(65537, 2048, default_backend())
+    else:
+        key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    private_file = os.path.join(directory, "private.pem")
+    public_file = os.path.join(directory, "public.pem")
+    with open(private_file, "wb") as private:
+        private.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    with open(public_file, "wb") as public:
+        public.write(
+            key.public_key().public_bytes(
+                serialization.Encoding.PEM,
+                serialization.PublicFormat.SubjectPublicKeyInfo,
+            )
+        )
+    return private_file, public_file
+
+
+async def handler(request):
+    return web.Response(text=request.user)
+
+
+async def run_mode(middleware, requests: list, memo: bool) -> float:
+    """
+    Pass requests through the middleware
+    :param middleware: middleware handler
+    :param requests: mocked requests
+    :param memo: keep verified tokens memo, or clear it before every request
+    :return: requests per second
+    """
+    verified_tokens.clear()
+    started = perf_counter()
+    for request in requests:
+        if not memo:
+            verified_tokens.clear()
+        response = await middleware(request)
+        assert response.status == 200, response.status
+    return len(requests) / (perf_counter() - started)
+
+
+async def run(args) -> dict:
+    with TemporaryDirectory() as directory:
+        if args.algorithm.startswith("HS"):
+            auth.keys = TokenKeys(algorithm=args.algorithm)
+        else:
+            private_file, public_file = generate_keys(args.algorithm, directory)
+            auth.keys = TokenKeys(
+                algorithm=args.algorithm,
+                private_key_file=private_file,
+                public_key_file=public_file,
+            )
+        await auth.keys.load()
+
+    headers = []
+    for number in range(args.users):
+        username, jti = f"bench{number}", get_jti()
+        jti_cache.local.set(username, jti, ttl=float("inf"))
+        headers.append({"Authorization": f"Bearer {get_token(username, jti, number)}"})
+    requests = [
+        make_mocked_request(
+            "GET", "/api/chat/history", headers=headers[i % len(headers)]
+        )
+        for i in range(args.requests)
+    ]
+    middleware = await auth_middleware(web.Application(), handler)
+
+    results = {"algorithm": args.algorithm, "users": args.users}
+    results["no_memo_rps"] = await run_mode(middleware, requests, memo=False)
+    results["memo_rps"] = await run_mode(middleware, requests, memo=True)
+    results["speedup"] = results["memo_rps"] / results["no_memo_rps"]
+    return results
+
+
+def main():
+    parser = ArgumentParser(description="auth_middleware requests/sec benchmark")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument(
+        "--algorithm", default="HS256", choices=("HS256", "RS256", "ES256")
+    )
+    args = parser.parse_args()
+    report = asyncio.get_event_loop().run_until_complete(run(args))
+    print(dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
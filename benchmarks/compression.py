@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Compare bytes on wire and CPU per broadcast message for WebSocket
+permessage-deflate modes:
+- none: pre-built uncompressed frame, shared by all clients
+- per_client: compressor with context takeover per client (aiohttp default)
+- shared: compressed once with no context takeover, shared by all clients
+
+Usage: python -m benchmarks.compression --clients 1000 --messages 200
+"""
+
+import zlib
+from argparse import ArgumentParser
+from datetime import datetime
+from json import dumps
+from random import Random
+from time import process_time
+
+from aiohttp import WSMsgType
+
+from chat.utils.codec import dumps as encode
+from chat.ws.compression import DEFLATE_TRAILING, deflate
+from chat.ws.frames import RSV1, Frame, header
+from chat.ws.messages import chat_message
+
+WORDS = (
+    "hello hi everyone how are you doing today I think that we should "
+    "deploy the new version after lunch did anybody see the latest build "
+    "logs it looks like the tests are green again thanks for the review "
+    "let me check it and come back in five minutes ok sounds good"
+).split()
+
+
+def generate_messages(count: int, seed: int = 0) -> list:
+    """
+    Generate realistic chat messages
+    :param count: number of messages
+    :param seed: random seed
+    :return: list of encoded JSON payloads
+    """
+    random = Random(seed)
+    users = [f"user{number}" for number in range(20)]
+    return [
+        encode(
+            chat_message(
+                random.choice(users),
+                " ".join(random.choices(WORDS, k=random.randint(3, 25))),
+                datetime.now(),
+                "general",
+            )
+        )
+        for _ in range(count)
+    ]
+
+
+def run_none(payloads: list, clients: int) -> tuple:
+    started = process_time()
+    wire = 0
+    for payload in payloads:
+        wire += len(Frame(payload).data) * clients
+    return wire, process_time() - started
+
+
+def run_per_client(payloads: list, clients: int, level: int) -> tuple:
+    compressors = [zlib.compressobj(level, zlib.DEFLATED, -15) for _ in range(clients)]
+    started = process_time()
+    wire = 0
+    for payload in payloads:
+        for compressor in compressors:
+            data = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data.endswith(DEFLATE_TRAILING):
+                data = data[:-4]
+            # Header size is the same as for a pre-built frame of this length
+            wire += len(data) + (2 if len(data) < 126 else 4)
+    return wire, process_time() - started
+
+
+def run_shared(payloads: list, clients: int, level: int) -> tuple:
+    started = process_time()
+    wire = 0
+    for payload in payloads:
+        data = deflate(payload, 15, level)
+        wire += len(header(len(data), WSMsgType.TEXT, RSV1) + data) * clients
+    return wire, process_time() - started
+
+
+def main():
+    parser = ArgumentParser(description="WebSocket compression benchmark")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--level", type=int, default=6)
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    payloads = generate_messages(args.messages)
+    runs = {
+        "none": run_none(payloads, args.clients),
+        "per_client": run_per_client(payloads, args.clients, args.level),
+        "shared": run_shared(payloads, args.clients, args.level),
+    }
+    messages = args.messages * args.clients
+    results = {
+        mode: {
+            "bytes_per_message": wire / messages,
+            "cpu_us_per_broadcast": cpu / args.messages * 1e6,
+        }
+        for mode, (wire, cpu) in runs.items()
+    }
+
+    if args.json:
+        print(dumps({"clients": args.clients, "results": results}, indent=2))
+        return
+    print(f"{args.clients} clients, {args.messages} messages, level {args.level}")
+    print(f"{'mode':<12}{'bytes/msg':>12}{'cpu us/broadcast':>20}")
+    for mode, result in results.items():
+        print(
+            f"{mode:<12}{result['bytes_per_message']:>12.1f}"
+            f"{result['cpu_us_per_broadcast']:>20.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
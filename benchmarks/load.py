@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+WebSocket load generator and broadcast latency benchmark.
+
+Opens N authenticated WebSocket clients, drives messages from some of them
+at the configured total rate and measures on every receiver:
+- delivery latency: time from send to receive, per delivered copy
+- fan-out latency: time from send until the last client received it
+plus throughput and server RSS/CPU (Linux /proc, local process or --pid).
+
+Run against a started server:
+    python -m benchmarks.load --url http://localhost:8080 --pid <server pid>
+or start create_app() in this process (Postgres and Redis from the usual
+environment variables, e.g. the docker-compose services):
+    python -m benchmarks.load --local --clients 200 --rate 50 --duration 30
+In --local mode server CPU includes the load generator itself, and the rate
+limits are off: every client registers and logs in from one address.
+Against a started server raise them in its environment first, e.g.
+    RATE_LIMIT_LOGIN_RATE=0 RATE_LIMIT_REGISTER_RATE=0 RATE_LIMIT_MESSAGE_RATE=0
+(0 - no limit), otherwise logins get 429 after the burst.
+
+Results are printed and written as JSON (--output) to compare runs.
+"""
+
+import asyncio
+import os
+from argparse import ArgumentParser
+from json import dump, dumps as json_dumps
+from time import time
+
+from aiohttp import ClientSession, WSMsgType, web
+
+from chat.utils.codec import dumps, loads
+
+PASSWORD = "benchmark-password"
+MARKER = "bench"
+
+
+def percentiles(values: list) -> dict:
+    """
+    Calculate latency percentiles in milliseconds
+    :param values: latencies in seconds
+    :return: dict with p50, p99, p999 and max
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def percentile(fraction: float) -> float:
+        return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+    return {
+        "p50": percentile(0.5),
+        "p99": percentile(0.99),
+        "p999": percentile(0.999),
+        "max": values[-1] * 1000,
+    }
+
+
+class ProcessStats:
+    """
+    Read RSS and CPU time of the server process from /proc
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+
+    def rss_mb(self) -> float:
+        with open(f"/proc/{self.pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        # utime and stime, fields 14 and 15 of /proc/<pid>/stat
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+
+class LoadClient:
+    """
+    One authenticated WebSocket client
+    """
+
+    def __init__(self, number: int, results: dict):
+        self.username = f"{MARKER}{number}"
+        self.results = results
+        self.websocket = None
+        self.received = 0
+
+    async def login(self, session: ClientSession, url: str) -> str:
+        credentials = {"username": self.username, "password": PASSWORD}
+        async with session.post(f"{url}/api/register", json=credentials):
+            pass
+        async with session.post(f"{url}/api/login", json=credentials) as response:
+            token = (await response.json()).get("token")
+        if not token:
+            raise RuntimeError(f"Failed to login {self.username}")
+        return token
+
+    async def connect(self, session: ClientSession, url: str, origin: str) -> None:
+        token = await self.login(session, url)
+        ws_url = url.replace("http", "ws", 1) + "/api/chat/ws"
+        self.websocket = await session.ws_connect(ws_url, headers={"Origin": origin})
+        await self.websocket.send_str(
+            dumps({"token": token, "message": "auth"}).decode("utf-8")
+        )
+
+    async def receive(self) -> None:
+        async for message in self.websocket:
+            if message.type != WSMsgType.TEXT:
+                break
+            received = time()
+            data = loads(message.data)
+            for chat_message in data if isinstance(data, list) else [data]:
+                self.on_message(chat_message.get("message") or "", received)
+
+    def on_message(self, text: str, received: float) -> None:
+        # Benchmark messages are "bench:<message id>:<send time>"
+        if not text.startswith(f"{MARKER}:"):
+            return
+        _, message_id, sent = text.split(":", 2)
+        self.received += 1
+        self.results["latencies"].append(received - float(sent))
+        deliveries = self.results["deliveries"]
+        deliveries[message_id] = max(deliveries.get(message_id, 0), received)
+
+    async def send(self, rate: float, until: float, counter: list) -> None:
+        interval = 1 / rate
+        while time() < until:
+            counter[0] += 1
+            message_id = f"{self.username}-{counter[0]}"
+            sent = time()
+            self.results["sent"][message_id] = sent
+            await self.websocket.send_str(
+                dumps({"message": f"{MARKER}:{message_id}:{sent}"}).decode("utf-8")
+            )
+            await asyncio.sleep(interval)
+
+
+async def start_local(port: int):
+    """
+    Start create_app() in this process, without rate limits
+    :param port: port to listen
+    :return: app runner
+    """
+    from chat.api.app import create_app
+    from chat.utils.ratelimit import login_limiter, message_limiter, register_limiter
+
+    for limiter in (login_limiter, message_limiter, register_limiter):
+        limiter.rate = 0
+
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    await web.TCPSite(runner, "localhost", port).start()
+    return runner
+
+
+async def run(args) -> dict:
+    runner = None
+    url = args.url
+    pid = args.pid
+    if args.local:
+        runner = await start_local(args.port)
+        url = f"http://localhost:{args.port}"
+        pid = os.getpid()
+    stats = ProcessStats(pid) if pid else None
+
+    results = {"latencies": [], "deliveries": {}, "sent": {}}
+    clients = [LoadClient(number, results) for number in range(args.clients)]
+    async with ClientSession() as session:
+        # Logins are deliberately expensive (argon2), don't run them all at once
+        semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+        async def connect(client):
+            async with semaphore:
+                await client.connect(session, url, args.origin)
+
+        await asyncio.gather(*[connect(client) for client in clients])
+        receivers = [asyncio.ensure_future(client.receive()) for client in clients]
+        await asyncio.sleep(1)
+
+        rss_start = stats.rss_mb() if stats else None
+        cpu_start = stats.cpu_seconds() if stats else None
+        started = time()
+        until = started + args.duration
+        senders = clients[: args.senders]
+        counter = [0]
+        await asyncio.gather(
+            *[
+                client.send(args.rate / len(senders), until, counter)
+                for client in senders
+            ]
+        )
+        # Give the last messages time to arrive
+        await asyncio.sleep(args.drain)
+        elapsed = time() - started
+        cpu_end = stats.cpu_seconds() if stats else None
+        rss_end = stats.rss_mb() if stats else None
+
+        for client in clients:
+            await client.websocket.close()
+        for receiver in receivers:
+            receiver.cancel()
+
+    if runner is not None:
+        await runner.cleanup()
+
+    sent = results["sent"]
+    fanout = [
+        results["deliveries"][message_id] - sent_time
+        for message_id, sent_time in sent.items()
+        if message_id in results["deliveries"]
+    ]
+    delivered = len(results["latencies"])
+    report = {
+        "config": {
+            "clients": args.clients,
+            "senders": len(senders),
+            "rate": args.rate,
+            "duration": args.duration,
+        },
+        "sent": len(sent),
+        "delivered": delivered,
+        "expected": len(sent) * args.clients,
+        "throughput": {
+            "sent_per_second": len(sent) / args.duration,
+            "delivered_per_second": delivered / elapsed,
+        },
+        "latency_ms": percentiles(results["latencies"]),
+        "fanout_ms": percentiles(fanout),
+    }
+    if stats:
+        report["server"] = {
+            "rss_mb_start": rss_start,
+            "rss_mb_end": rss_end,
+            "cpu_percent": (cpu_end - cpu_start) / elapsed * 100,
+        }
+    return report
+
+
+def main():
+    parser = ArgumentParser(description="WebSocket load and latency benchmark")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--origin", default="http://localhost")
+    parser.add_argument("--local", action="store_true", help="run create_app() here")
+    parser.add_argument("--port", type=int, default=8081, help="port for --local")
+    parser.add_argument("--pid", type=int, help="server pid for RSS/CPU stats")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=20, help="total messages/s")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--drain", type=float, default=2, help="seconds to wait")
+    parser.add_argument("--connect-concurrency", type=int, default=8)
+    parser.add_argument("--output", help="JSON file to write results to")
+    args = parser.parse_args()
+
+    report = asyncio.get_event_loop().run_until_complete(run(args))
+    print(json_dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,36 @@
 #!/usr/bin/env python3
+from argparse import ArgumentParser
 
-from aiohttp.web import run_app
-
-from chat.api.app import create_app
+from chat.api.workers import Supervisor, run_worker
 from chat.db.base import Base, Engine
+from chat.db.migrations import migrate
+from chat.utils.config import ServiceConfiguration, WorkerValues
 
 
 def main():
     """
-    Create database engine, create application and run it
+    Create database engine, apply migrations, create application and run it
+    with the event loop watchdog, in one process or in several workers
     :return: None
     """
+    parser = ArgumentParser(description="WebSocket chat")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WorkerValues.WORKERS,
+        help="worker processes sharing the port (Redis broadcast backend is used)",
+    )
+    parser.add_argument("--host", default=ServiceConfiguration.HOST)
+    parser.add_argument("--port", type=int, default=ServiceConfiguration.PORT)
+    args = parser.parse_args()
+
+    # Once, before forking workers
     Base.metadata.create_all(Engine)
-    app = create_app()
-    run_app(app)
+    migrate(Engine)
+    if args.workers > 1:
+        Supervisor(args.workers, host=args.host, port=args.port).run()
+    else:
+        run_worker(host=args.host, port=args.port)
 
 
 if __name__ == "__main__":
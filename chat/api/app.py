@@ -4,34 +4,77 @@ import aiohttp_csrf
 from aiohttp import web
 from aiohttp.web_app import Application
 
+from chat.db.base import close_engine
+from chat.db.crud import DatabaseCrud
+from chat.db.writer import MessageWriter
 from chat.handlers.chat import Chat
 from chat.handlers.feedback import Feedback
 from chat.handlers.healthcheck import HealthCheck
+from chat.handlers.history import History
 from chat.handlers.home import Home
 from chat.handlers.login import Login
 from chat.handlers.logout import Logout
+from chat.handlers.metrics import Metrics
+from chat.handlers.presence import Presence
 from chat.handlers.register import Register
 from chat.handlers.websockets import WebSockets
-from chat.middlewares.auth import auth_middleware
+from chat.middlewares.auth import (
+    auth_middleware,
+    cache,
+    jti_cache,
+    keys,
+    verified_tokens,
+)
 from chat.middlewares.csrf import csrf
-from chat.utils.config import DefaultPaths, CSRFCongiruation
+from chat.middlewares.metrics import metrics_middleware
+from chat.utils.config import BroadcastValues, CSRFCongiruation, WatchdogValues
+from chat.utils.metrics import (
+    JTI_CACHE_HITS,
+    JTI_CACHE_MISSES,
+    JWT_MEMO_HITS,
+    JWT_MEMO_MISSES,
+    WRITER_QUEUE_DEPTH,
+)
+from chat.utils.passwords import passwords
+from chat.utils.ratelimit import share_limits
+from chat.utils.serve import Serve, assets
+from chat.utils.watchdog import LoopWatchdog
+from chat.ws.backend import create_backend
+from chat.ws.presence import PresenceService
 
 # Define logging to console
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
 
-def create_app():
+def create_app(backend: str = BroadcastValues.BACKEND):
     """
     Create basic application, define API endpoints
+    :param backend: broadcast backend name ("redis" to run several workers)
     :return: web app
     """
-    ws = WebSockets(log)
+    # Several workers share rate limits and online users through Redis too
+    shared = backend == "redis"
+    if shared:
+        share_limits(cache)
+    writer = MessageWriter(log)
+    backend = create_backend(log, backend, last_seq=DatabaseCrud.get_last_seq)
+    presence = PresenceService(log, backend, cache=cache if shared else None)
+    ws = WebSockets(log, writer, backend, presence)
+
+    # Counters owned by other components are read on scrape only
+    WRITER_QUEUE_DEPTH.set_function(
+        lambda: writer.queue.qsize() if writer.queue is not None else 0
+    )
+    JTI_CACHE_HITS.set_function(lambda: jti_cache.local.hits)
+    JTI_CACHE_MISSES.set_function(lambda: jti_cache.local.misses)
+    JWT_MEMO_HITS.set_function(lambda: verified_tokens.hits)
+    JWT_MEMO_MISSES.set_function(lambda: verified_tokens.misses)
 
     csrf_policy = aiohttp_csrf.policy.FormPolicy(CSRFCongiruation.FORM_FIELD_NAME)
     csrf_storage = aiohttp_csrf.storage.CookieStorage(CSRFCongiruation.COOKIE_NAME)
 
-    app = Application(middlewares=[auth_middleware])
+    app = Application(middlewares=[metrics_middleware, auth_middleware])
     app.add_routes(
         routes=[
             # Render
@@ -44,14 +87,44 @@ def create_app():
             web.post("/api/login", Login.post),
             web.post("/api/logout", Logout.post),
             web.get("/api/chat/ws", ws.get),
+            web.get("/api/chat/history", History.get),
+            web.get("/api/chat/presence", Presence(presence).get),
             web.get("/api/health", HealthCheck.get),
+            web.get("/api/metrics", Metrics.get),
             # Static
-            web.static("/static/js", path=DefaultPaths.STATIC_JS, append_version=True),
+            web.get("/static/js/{name}", Serve.script),
             # Feedback
             web.view("/feedback", Feedback),
         ]
     )
 
+    # Report handlers blocking the event loop, startup included
+    if WatchdogValues.ENABLED:
+        watchdog = LoopWatchdog(logging.getLogger("chat.watchdog"))
+        app.on_startup.append(watchdog.start)
+        app.on_cleanup.append(watchdog.stop)
+    # Templates and scripts are served from memory
+    app.on_startup.append(assets.load)
+    # Reap dead and idle WebSockets, close the rest gracefully on shutdown
+    app.on_startup.append(ws.start)
+    app.on_shutdown.append(ws.shutdown)
+    app.on_cleanup.append(ws.stop)
+    # Batched join/leave diffs, the last one is sent before the backend stops
+    app.on_startup.append(presence.start)
+    app.on_cleanup.append(presence.stop)
+    # Background message writer, drained after all handlers are finished
+    app.on_startup.append(writer.start)
+    app.on_cleanup.append(writer.stop)
+    app.on_startup.append(backend.start)
+    app.on_cleanup.append(backend.stop)
+    app.on_startup.append(keys.load)
+    app.on_startup.append(cache.connect)
+    app.on_startup.append(jti_cache.start)
+    app.on_cleanup.append(jti_cache.stop)
+    app.on_cleanup.append(cache.close)
+    app.on_cleanup.append(passwords.close)
+    app.on_cleanup.append(close_engine)
+
     aiohttp_csrf.setup(app, policy=csrf_policy, storage=csrf_storage)
     app.middlewares.append(csrf)
     return app
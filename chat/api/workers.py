@@ -0,0 +1,196 @@
+import logging
+import os
+import signal
+import socket
+from asyncio import new_event_loop, set_event_loop
+from time import monotonic, sleep
+
+from aiohttp.web import run_app
+
+from chat.api.app import create_app
+from chat.utils.config import BroadcastValues, ServiceConfiguration, WorkerValues
+
+log = logging.getLogger(__name__)
+
+
+def run_worker(
+    host: str = None,
+    port: int = None,
+    sock: socket.socket = None,
+    backend: str = BroadcastValues.BACKEND,
+) -> None:
+    """
+    Create application and run it
+    :param host: host to listen
+    :param port: port to listen
+    :param sock: listening socket shared by the workers (instead of host and port)
+    :param backend: broadcast backend name
+    :return: None
+    """
+    run_app(create_app(backend=backend), host=host, port=port, sock=sock)
+
+
+def exit_code(status: int) -> int:
+    """
+    Decode waitpid() status
+    :param status: status
+    :return: exit code, or -signal number if killed by signal
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class Supervisor:
+    """
+    Run several worker processes on one listening socket.
+    The socket is created before forking and inherited by every worker,
+    the kernel spreads incoming connections between them. Crashed workers
+    are restarted, SIGHUP restarts workers one by one, SIGTERM/SIGINT stop
+    them one by one, so the rest keep serving until their turn.
+    Messages are shared between workers through the Redis broadcast backend.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        host: str = ServiceConfiguration.HOST,
+        port: int = ServiceConfiguration.PORT,
+        shutdown_timeout: float = WorkerValues.SHUTDOWN_TIMEOUT,
+        restart_delay: float = WorkerValues.RESTART_DELAY,
+    ):
+        """
+        Init supervisor
+        :param workers: number of worker processes
+        :param host: host to listen
+        :param port: port to listen
+        :param shutdown_timeout: seconds to wait for a worker to stop before SIGKILL
+        :param restart_delay: pause before restarting a worker that crashed on start
+        """
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.shutdown_timeout = shutdown_timeout
+        self.restart_delay = restart_delay
+        # pid -> start time
+        self.pids = {}
+        self.sock = None
+        self._stopping = False
+        self._restarting = False
+
+    def listen(self) -> socket.socket:
+        """
+        Create listening socket to share between workers
+        :return: socket
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(1024)
+        sock.setblocking(False)
+        return sock
+
+    def spawn(self) -> int:
+        """
+        Fork worker process
+        :return: worker pid
+        """
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+                    signal.signal(signum, signal.SIG_DFL)
+                # Never share the event loop (and its selector) with the parent
+                set_event_loop(new_event_loop())
+                run_worker(sock=self.sock, backend="redis")
+            except BaseException:
+                log.exception(f"Worker {os.getpid()} failed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.pids[pid] = monotonic()
+        log.info(f"Started worker {pid}")
+        return pid
+
+    def stop_worker(self, pid: int) -> None:
+        """
+        Stop worker gracefully, kill it if it doesn't stop in time
+        :param pid: worker pid
+        :return: None
+        """
+        self.pids.pop(pid, None)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = monotonic() + self.shutdown_timeout
+        while monotonic() < deadline:
+            finished, status = os.waitpid(pid, os.WNOHANG)
+            if finished:
+                log.info(f"Worker {pid} stopped with code {exit_code(status)}")
+                return
+            sleep(0.1)
+        log.warning(f"Worker {pid} didn't stop in time, kill it")
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+    def restart_all(self) -> None:
+        """
+        Rolling restart: start a new worker, then stop an old one
+        :return: None
+        """
+        for pid in list(self.pids):
+            self.spawn()
+            self.stop_worker(pid)
+
+    def reap(self) -> bool:
+        """
+        Restart crashed worker if any
+        :return: True if some worker has exited
+        """
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return False
+        if not pid or pid not in self.pids:
+            return bool(pid)
+        started = self.pids.pop(pid)
+        log.error(f"Worker {pid} exited with code {exit_code(status)}, restart it")
+        # Don't spin if the worker fails right on start
+        if monotonic() - started < self.restart_delay:
+            sleep(self.restart_delay)
+        self.spawn()
+        return True
+
+    def _stop(self, signum, frame) -> None:
+        self._stopping = True
+
+    def _restart(self, signum, frame) -> None:
+        self._restarting = True
+
+    def run(self) -> None:
+        """
+        Start workers and supervise them until SIGTERM/SIGINT
+        :return: None
+        """
+        self.sock = self.listen()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._restart)
+        log.info(f"Listen on {self.host}:{self.port} with {self.workers} workers")
+        for _ in range(self.workers):
+            self.spawn()
+
+        while not self._stopping:
+            if self._restarting:
+                self._restarting = False
+                log.info("Restart workers")
+                self.restart_all()
+            elif not self.reap():
+                sleep(0.2)
+
+        log.info("Stop workers")
+        for pid in list(self.pids):
+            self.stop_worker(pid)
+        self.sock.close()
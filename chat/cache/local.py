@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from time import monotonic
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache with per-entry TTL
+    """
+
+    def __init__(self, size: int, ttl: float):
+        """
+        Init cache
+        :param size: max entries, the least recently used one is evicted first
+        :param ttl: entry lifetime in seconds
+        """
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Get value by key, count hit or miss
+        :param key: key
+        :param default: value to return on miss
+        :return: value or default
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl: float = None) -> None:
+        """
+        Set value by key, evict the least recently used entry if full
+        :param key: key
+        :param value: value
+        :param ttl: lifetime of this entry in seconds, default from self
+        :return: None
+        """
+        self._entries[key] = (value, monotonic() + (self.ttl if ttl is None else ttl))
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key) -> None:
+        """
+        Delete value by key
+        :param key: key
+        :return: None
+        """
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Delete all values
+        :return: None
+        """
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Cache counters
+        :return: dict with counters
+        """
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,145 @@
+from asyncio import CancelledError, get_event_loop, sleep
+
+import aioredis
+
+from chat.cache.local import LocalCache
+from chat.cache.storage import RedisCache
+from chat.utils.config import JTICacheValues
+
+# Cached "no active JTI" value, None means "not cached"
+MISSING = ""
+
+
+class JTICache:
+    """
+    Username -> JTI mapping with in-process cache in front of Redis.
+    Login and logout publish the username to the invalidation channel,
+    so every worker drops its local copy and revocation stays correct.
+    """
+
+    def __init__(
+        self,
+        cache: RedisCache,
+        log,
+        size: int = JTICacheValues.SIZE,
+        ttl: float = JTICacheValues.TTL,
+        channel: str = JTICacheValues.CHANNEL,
+    ):
+        """
+        Init cache
+        :param cache: Redis cache
+        :param log: logger to use
+        :param size: max usernames to keep in memory
+        :param ttl: seconds to keep one username in memory
+        :param channel: invalidation pub/sub channel
+        """
+        self.cache = cache
+        self.log = log
+        self.channel = channel
+        self.local = LocalCache(size=size, ttl=ttl)
+        # Bumped on every invalidation, so a Redis read racing with it is not cached
+        self._generation = 0
+        self._subscriber = None
+        self._task = None
+
+    async def start(self, app=None) -> None:
+        """
+        Subscribe to the invalidation channel (on_startup signal)
+        :param app: web app
+        :return: None
+        """
+        self._task = get_event_loop().create_task(self._listen())
+
+    async def stop(self, app=None) -> None:
+        """
+        Unsubscribe from the invalidation channel (on_cleanup signal)
+        :param app: web app
+        :return: None
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+            self._task = None
+
+    async def _listen(self) -> None:
+        """
+        Drop invalidated usernames, resubscribe if the connection is lost.
+        Local cache is cleared on reconnect, invalidations could be missed.
+        :return: None
+        """
+        while True:
+            try:
+                self._subscriber = await aioredis.create_redis(
+                    self.cache.options["address"]
+                )
+                (channel,) = await self._subscriber.subscribe(self.channel)
+                self._invalidate()
+                async for username in channel.iter(encoding="utf-8"):
+                    self._invalidate(username)
+            except CancelledError:
+                raise
+            except Exception as error:
+                self.log.error(f"JTI invalidation channel error: {error}")
+            finally:
+                if self._subscriber is not None:
+                    self._subscriber.close()
+                    self._subscriber = None
+            self._invalidate()
+            await sleep(1)
+
+    def _invalidate(self, username: str or None = None) -> None:
+        """
+        Drop one username or everything from the local cache
+        :param username: username, None to drop everything
+        :return: None
+        """
+        self._generation += 1
+        if username is None:
+            self.local.clear()
+        else:
+            self.local.delete(username)
+
+    async def get(self, username: str) -> str or None:
+        """
+        Get active JTI of the user, from memory when possible
+        :param username: username
+        :return: JTI or None
+        """
+        jti = self.local.get(username)
+        if jti is None:
+            generation = self._generation
+            jti = await self.cache.get(username) or MISSING
+            if generation == self._generation:
+                self.local.set(username, jti)
+        return jti or None
+
+    async def set(self, username: str, jti: str) -> None:
+        """
+        Save active JTI of the user, invalidate other workers
+        :param username: username
+        :param jti: JTI
+        :return: None
+        """
+        await self.cache.set(key=username, value=jti)
+        await self.cache.publish(self.channel, username)
+        self._invalidate(username)
+
+    async def delete(self, username: str) -> None:
+        """
+        Revoke JTI of the user, invalidate other workers
+        :param username: username
+        :return: None
+        """
+        await self.cache.delitem(username)
+        await self.cache.publish(self.channel, username)
+        self._invalidate(username)
+
+    def stats(self) -> dict:
+        """
+        Local cache counters
+        :return: dict with counters
+        """
+        return self.local.stats()
@@ -1,62 +1,148 @@
 #!/usr/bin/env python3
 
-from redis import Redis
+from functools import lru_cache
+from hashlib import sha1
+
+import aioredis
 
 from chat.utils.config import CacheValues
+from chat.utils.metrics import REDIS_LATENCY, timed
+
+
+@lru_cache(maxsize=None)
+def script_sha(script: str) -> str:
+    """
+    Get SHA1 digest of the Lua script (EVALSHA key)
+    :param script: Lua script
+    :return: hex digest
+    """
+    return sha1(script.encode("utf-8")).hexdigest()
 
 
 class RedisCache:
     """
-    Redis cache handler
+    Redis cache handler, asyncio-native with a connection pool
     """
 
     def __init__(
-        self, host: str = CacheValues.REDIS_HOST, expire: int = CacheValues.REDIS_EXP,
+        self,
+        address: str = CacheValues.REDIS_ADDRESS,
+        expire: int = CacheValues.REDIS_EXP,
+        minsize: int = CacheValues.REDIS_POOL_MINSIZE,
+        maxsize: int = CacheValues.REDIS_POOL_MAXSIZE,
     ):
         """
-        Init handler with host to connect and default expiration time in seconds
-        :param host: host to connect
+        Init handler with address to connect and default expiration time in seconds
+        :param address: address to connect
         :param expire: expiration time
+        :param minsize: min connections in the pool
+        :param maxsize: max connections in the pool
+        """
+        self.options = dict(
+            address=address, expire=expire, minsize=minsize, maxsize=maxsize
+        )
+        self.redis = None
+
+    async def connect(self, app=None) -> None:
+        """
+        Create connection pool (on_startup signal)
+        :param app: web app
+        :return: None
         """
-        self.options = dict(expire=expire)
-        self.redis = Redis(host=host)
+        if self.redis is None:
+            self.redis = await aioredis.create_redis_pool(
+                self.options["address"],
+                minsize=self.options["minsize"],
+                maxsize=self.options["maxsize"],
+                encoding="utf-8",
+            )
 
-    def get(self, key) -> dict or list or None:
+    async def close(self, app=None) -> None:
         """
-        Get value by key
+        Close connection pool (on_cleanup signal)
+        :param app: web app
+        :return: None
+        """
+        if self.redis is not None:
+            self.redis.close()
+            await self.redis.wait_closed()
+            self.redis = None
+
+    async def _pool(self):
+        """
+        Get connection pool, connect on first use
+        :return: aioredis pool
+        """
+        if self.redis is None:
+            await self.connect()
+        return self.redis
+
+    @timed(REDIS_LATENCY.labels("get"))
+    async def get(self, key) -> str or None:
+        """
+        Get value by key, one round-trip (None if key doesn't exist)
         :param key: key
         :return: value
         """
-        if self.exists(key):
-            return self.redis.get(key)
-        return None
+        redis = await self._pool()
+        return await redis.get(key)
 
-    def set(self, key, value, expire=None) -> None:
+    @timed(REDIS_LATENCY.labels("set"))
+    async def set(self, key, value, expire=None) -> None:
         """
-        Set value by key
+        Set value by key with expiration in one round-trip
         :param key: key
         :param value: value
         :param expire: expiration time in seconds, or default from self
         :return: None
         """
-        self.redis.set(key, value)
-        if expire:
-            self.redis.expire(key, expire)
-        else:
-            self.redis.expire(key, self.options["expire"])
+        redis = await self._pool()
+        await redis.set(key, value, expire=expire or self.options["expire"])
 
-    def delitem(self, key) -> None:
+    @timed(REDIS_LATENCY.labels("delitem"))
+    async def delitem(self, key) -> None:
         """
         Delete value by key
         :param key: key to use
         :return: None
         """
-        self.redis.delete(key)
+        redis = await self._pool()
+        await redis.delete(key)
+
+    @timed(REDIS_LATENCY.labels("publish"))
+    async def publish(self, channel: str, message: str) -> None:
+        """
+        Publish message to the pub/sub channel
+        :param channel: channel name
+        :param message: message
+        :return: None
+        """
+        redis = await self._pool()
+        await redis.publish(channel, message)
+
+    @timed(REDIS_LATENCY.labels("eval"))
+    async def eval(self, script: str, keys: list, args: list):
+        """
+        Run Lua script atomically, by SHA1 once Redis has cached the script
+        :param script: Lua script
+        :param keys: script keys
+        :param args: script args
+        :return: script result
+        """
+        redis = await self._pool()
+        try:
+            return await redis.evalsha(script_sha(script), keys=keys, args=args)
+        except aioredis.ReplyError as error:
+            if not str(error).startswith("NOSCRIPT"):
+                raise
+        return await redis.eval(script, keys=keys, args=args)
 
-    def exists(self, key) -> bool:
+    @timed(REDIS_LATENCY.labels("exists"))
+    async def exists(self, key) -> bool:
         """
         Check if key exists
         :param key:
         :return: None
         """
-        return bool(self.redis.exists(key))
+        redis = await self._pool()
+        return bool(await redis.exists(key))
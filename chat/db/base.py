@@ -1,18 +1,34 @@
+from time import perf_counter
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
 from sqlalchemy_utils import database_exists, create_database
 
 from chat.utils.config import DbValues
+from chat.utils.metrics import DB_POOL_CHECKED_OUT, DB_POOL_UTILISATION, DB_POOL_WAIT
 
-# Create engine to connect to PostgreSQL, psycopg2 driver is required though
-Engine = create_engine(
-    f"postgres+psycopg2://"
+DATABASE_URL = (
     f"{DbValues.POSTGRES_USER}:{DbValues.POSTGRES_PASSWORD}@"
     f"{DbValues.POSTGRES_HOST}:{DbValues.POSTGRES_PORT}/"
-    f"{DbValues.POSTGRES_DATABASE}",
-    poolclass=NullPool,
+    f"{DbValues.POSTGRES_DATABASE}"
+)
+
+# Sync engine, used on startup only (create database, tables, migrations),
+# psycopg2 driver is required though
+Engine = create_engine(f"postgresql+psycopg2://{DATABASE_URL}", poolclass=NullPool)
+
+# Async engine with a size-limited connection pool, used by the application,
+# asyncpg driver is required
+AsyncEngine = create_async_engine(
+    f"postgresql+asyncpg://{DATABASE_URL}",
+    pool_size=DbValues.POOL_SIZE,
+    max_overflow=DbValues.POOL_MAX_OVERFLOW,
+    pool_timeout=DbValues.POOL_TIMEOUT,
+    pool_recycle=DbValues.POOL_RECYCLE,
+    pool_pre_ping=DbValues.POOL_PRE_PING,
 )
 
 # Create database if not exists yet
@@ -20,5 +36,49 @@ if not database_exists(Engine.url):
     create_database(Engine.url)
 
 # Define local session and base to use
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=Engine)
+SessionLocal = sessionmaker(
+    bind=AsyncEngine,
+    class_=AsyncSession,
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+)
 Base = declarative_base()
+
+
+def pool_utilisation() -> float:
+    """
+    Share of the pool capacity (size and max overflow) checked out
+    :return: 0..1
+    """
+    pool = AsyncEngine.sync_engine.pool
+    return pool.checkedout() / (pool.size() + DbValues.POOL_MAX_OVERFLOW)
+
+
+DB_POOL_CHECKED_OUT.set_function(AsyncEngine.sync_engine.pool.checkedout)
+DB_POOL_UTILISATION.set_function(pool_utilisation)
+
+
+async def open_session() -> AsyncSession:
+    """
+    Create session and check out a pooled connection, record the wait time
+    :return: session
+    """
+    db = SessionLocal()
+    started = perf_counter()
+    try:
+        await db.connection()
+    except:
+        await db.close()
+        raise
+    DB_POOL_WAIT.observe(perf_counter() - started)
+    return db
+
+
+async def close_engine(app=None) -> None:
+    """
+    Close all pooled connections (on_cleanup signal)
+    :param app: web app
+    :return: None
+    """
+    await AsyncEngine.dispose()
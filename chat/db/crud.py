@@ -1,14 +1,17 @@
 from datetime import datetime
 
-from argon2 import PasswordHasher
-from sqlalchemy import inspect
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, func, inspect, insert, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from chat.cache.local import LocalCache
 from chat.db import models
-from chat.db.base import SessionLocal
+from chat.db.base import open_session
+from chat.utils.config import DbValues, DirectValues, HistoryValues
+from chat.utils.metrics import DB_LATENCY, timed
+from chat.utils.passwords import HashingUnavailable, passwords
 
-# Use argon2 password hasher
-ph = PasswordHasher()
+# Username -> user_id, usernames are immutable so entries never expire
+user_ids = LocalCache(size=DbValues.USER_ID_CACHE_SIZE, ttl=float("inf"))
 
 
 # Transform object to represent as dict
@@ -20,113 +23,492 @@ def object_as_dict(obj):
 
 class DatabaseCrud:
     """
-    Handle database
+    Handle database, every operation uses a pooled connection
     """
 
     @staticmethod
-    def create_user(
-        username: str, password: str, db: Session = SessionLocal(), *args, **kwargs
+    async def create_user(
+        username: str, password: str, db: AsyncSession = None, *args, **kwargs
     ) -> None:
         """
-        Create user, hash password with Argon2
+        Create user, hash password with Argon2 in the hashing pool
+        (raises HashingUnavailable if the pool is busy)
         :param username: username
         :param password: password
-        :param db: session
+        :param db: session, new one from the pool by default
+        :param args: some args
+        :param kwargs: some kwargs
+        :return: None
+        """
+        password_hash = await passwords.hash(password)
+        await DatabaseCrud.add_user(username, password_hash, db)
+
+    @staticmethod
+    @timed(DB_LATENCY.labels("create_user"))
+    async def add_user(
+        username: str, password_hash: str, db: AsyncSession = None, *args, **kwargs
+    ) -> None:
+        """
+        Insert user with the already hashed password
+        :param username: username
+        :param password_hash: Argon2 hash
+        :param db: session, new one from the pool by default
         :param args: some args
         :param kwargs: some kwargs
         :return: None
         """
         try:
-            password_hash = ph.hash(password)
+            db = db or await open_session()
             db_user = models.User(username=username, password=password_hash)
             db.add(db_user)
-            db.commit()
+            await db.commit()
         except:
-            db.rollback()
+            if db is not None:
+                await db.rollback()
         finally:
-            db.close()
+            if db is not None:
+                await db.close()
 
     @staticmethod
-    def check_user_exists(
-        username: str, db: Session = SessionLocal(), *args, **kwargs
+    @timed(DB_LATENCY.labels("check_user_exists"))
+    async def check_user_exists(
+        username: str, db: AsyncSession = None, *args, **kwargs
     ) -> bool:
         """
         Check if user exists
         :param username: username
-        :param db: session
+        :param db: session, new one from the pool by default
         :param args: some args
         :param kwargs: some kwargs
         :return: True or False
         """
         try:
-            db_user = (
-                db.query(models.User).filter(models.User.username == username).first()
+            db = db or await open_session()
+            result = await db.execute(
+                select(models.User.user_id).filter(models.User.username == username)
             )
-            if db_user:
-                return True
+            return result.first() is not None
         except:
             return False
         finally:
-            db.close()
+            if db is not None:
+                await db.close()
 
     @staticmethod
-    def check_credentials(
-        username: str, password: str, db: Session = SessionLocal(), *args, **kwargs
+    async def check_credentials(
+        username: str, password: str, db: AsyncSession = None, *args, **kwargs
     ) -> bool:
         """
-        Check that credentials is correct, verify Argon2 hash
+        Check that credentials is correct, verify Argon2 hash in the hashing pool
+        (raises HashingUnavailable if the pool is busy). Hashes created with
+        outdated parameters are upgraded on successful check, if the pool
+        has a free slot.
         :param username: username
         :param password: password
-        :param db: session to use
+        :param db: session, new one from the pool by default
         :param args: some args
         :param kwargs: some kwargs
         :return: True if correct, else False
         """
+        db_user = await DatabaseCrud.get_credentials(username, db)
+        if not db_user:
+            return False
+        user_id, password_hash = db_user
+        if not await passwords.verify(password_hash, password):
+            return False
+        user_ids.set(username, user_id)
+        if passwords.needs_rehash(password_hash):
+            try:
+                new_hash = await passwords.hash(password)
+            except HashingUnavailable:
+                # The password is correct, upgrade the hash on one of the next logins
+                return True
+            await DatabaseCrud.update_password(username, new_hash)
+        return True
+
+    @staticmethod
+    @timed(DB_LATENCY.labels("check_credentials"))
+    async def get_credentials(
+        username: str, db: AsyncSession = None, *args, **kwargs
+    ) -> tuple or None:
+        """
+        Get user_id and password hash of the user
+        :param username: username
+        :param db: session, new one from the pool by default
+        :param args: some args
+        :param kwargs: some kwargs
+        :return: (user_id, password hash) or None
+        """
+        try:
+            db = db or await open_session()
+            result = await db.execute(
+                select(models.User.user_id, models.User.password).filter(
+                    models.User.username == username
+                )
+            )
+            db_user = result.first()
+            return tuple(db_user) if db_user else None
+        except:
+            return None
+        finally:
+            # Give the connection back before the slow hash verification
+            if db is not None:
+                await db.close()
+
+    @staticmethod
+    @timed(DB_LATENCY.labels("get_user_id"))
+    async def get_user_id(
+        username: str, db: AsyncSession = None, *args, **kwargs
+    ) -> int or None:
+        """
+        Resolve username to user_id, cached after the first lookup
+        :param username: username
+        :param db: session, new one from the pool by default
+        :param args: some args
+        :param kwargs: some kwargs
+        :return: user_id or None
+        """
+        user_id = user_ids.get(username)
+        if user_id is not None:
+            return user_id
         try:
-            db_user = (
-                db.query(models.User).filter(models.User.username == username).first()
+            db = db or await open_session()
+            result = await db.execute(
+                select(models.User.user_id).filter(models.User.username == username)
             )
-            if db_user:
-                return ph.verify(hash=db_user.password, password=password)
+            user_id = result.scalar()
         except:
+            return None
+        finally:
+            if db is not None:
+                await db.close()
+        if user_id is not None:
+            user_ids.set(username, user_id)
+        return user_id
+
+    @staticmethod
+    @timed(DB_LATENCY.labels("update_password"))
+    async def update_password(
+        username: str, password_hash: str, db: AsyncSession = None, *args, **kwargs
+    ) -> None:
+        """
+        Replace password hash of the user
+        :param username: username
+        :param password_hash: new Argon2 hash
+        :param db: session, new one from the pool by default
+        :param args: some args
+        :param kwargs: some kwargs
+        :return: None
+        """
+        try:
+            db = db or await open_session()
+            await db.execute(
+                update(models.User)
+                .where(models.User.username == username)
+                .values(password=password_hash)
+            )
+            await db.commit()
+        except:
+            if db is not None:
+                await db.rollback()
+        finally:
+            if db is not None:
+                await db.close()
+
+    @staticmethod
+    @timed(DB_LATENCY.labels("save_messages"))
+    async def save_messages(
+        messages: list, db: AsyncSession = None, *args, **kwargs
+    ) -> bool:
+        """
+        Save batch of user messages with one multi-row INSERT, no user lookups.
+        Unlike other methods, raises if no connection can be checked out,
+        so the writer can tell a rejected batch from an unavailable database
+        :param messages: list of dicts with owner_id, message, date_time, room and seq
+        :param db: session, new one from the pool by default
+        :param args: some args
+        :param kwargs: some kwargs
+        :return: True if saved (or nothing to save), False if the INSERT failed
+        """
+        rows = [
+            message
+            for message in messages
+            if isinstance(message.get("message"), str)
+            and message["message"]
+            and message.get("owner_id") is not None
+        ]
+        if not rows:
+            return True
+        db = db or await open_session()
+        try:
+            await db.execute(insert(models.Message).values(rows))
+            await db.commit()
+            return True
+        except:
+            await db.rollback()
             return False
         finally:
-            db.close()
+            await db.close()
 
     @staticmethod
-    def save_message(
-        username: str,
+    @timed(DB_LATENCY.labels("get_messages"))
+    async def get_messages(
+        room: str,
+        before: tuple = None,
+        limit: int = HistoryValues.PAGE_SIZE,
+        db: AsyncSession = None,
+        *args,
+        **kwargs
+    ) -> list:
+        """
+        Get one page of the room history, newest first.
+        Keyset pagination: the page starts right after the (date_time, message_id)
+        cursor, so every page costs one index range scan however deep it is.
+        :param room: room name
+        :param before: (date_time, message_id) of the last seen message, or None
+        :param limit: max messages
+        :param db: session, new one from the pool by default
+        :param args: some args
+        :param kwargs: some kwargs
+        :return: list of dicts with id, user, message, date_time, room and seq
+        """
+        query = (
+            select(
+                models.Message.message_id,
+                models.User.username,
+                models.Message.message,
+                models.Message.date_time,
+                models.Message.seq,
+            )
+            .join(models.User, models.Message.owner_id == models.User.user_id)
+            .filter(models.Message.room == room)
+        )
+        if before is not None:
+            query = query.filter(
+                tuple_(models.Message.date_time, models.Message.message_id)
+                < tuple_(*before)
+            )
+        query = query.order_by(
+            models.Message.date_time.desc(), models.Message.message_id.desc()
+        ).limit(limit)
+
+        try:
+            db = db or await open_session()
+            result = await db.execute(query)
+            return [
+                dict(
+                    id=message_id,
+                    user=username,
+                    message=message,
+                    date_time=date_time,
+                    room=room,
+                    seq=seq,
+                )
+                for message_id, username, message, date_time, seq in result.all()
+            ]
+        except:
+            return []
+        finally:
+            if db is not None:
+                await db.close()
+
+    @staticmethod
+    @timed(DB_LATENCY.labels("get_messages_since"))
+    async def get_messages_since(
+        room: str,
+        seq: int,
+        limit: int = HistoryValues.REPLAY_LIMIT,
+        db: AsyncSession = None,
+        *args,
+        **kwargs
+    ) -> list:
+        """
+        Get messages of the room after the sequence number, oldest first
+        :param room: room name
+        :param seq: sequence number of the last seen message
+        :param limit: max messages
+        :param db: session, new one from the pool by default
+        :param args: some args
+        :param kwargs: some kwargs
+        :return: list of dicts with id, user, message, date_time, room and seq
+        """
+        query = (
+            select(
+                models.Message.message_id,
+                models.User.username,
+                models.Message.message,
+                models.Message.date_time,
+                models.Message.seq,
+            )
+            .join(models.User, models.Message.owner_id == models.User.user_id)
+            .filter(models.Message.room == room, models.Message.seq > seq)
+            .order_by(models.Message.seq)
+            .limit(limit)
+        )
+
+        try:
+            db = db or await open_session()
+            result = await db.execute(query)
+            return [
+                dict(
+                    id=message_id,
+                    user=username,
+                    message=message,
+                    date_time=date_time,
+                    room=room,
+                    seq=message_seq,
+                )
+                for message_id, username, message, date_time, message_seq in result.all()
+            ]
+        except:
+            return []
+        finally:
+            if db is not None:
+                await db.close()
+
+    @staticmethod
+    @timed(DB_LATENCY.labels("get_last_seq"))
+    async def get_last_seq(room: str, db: AsyncSession = None, *args, **kwargs) -> int:
+        """
+        Get the last saved sequence number of the room
+        :param room: room name
+        :param db: session, new one from the pool by default
+        :param args: some args
+        :param kwargs: some kwargs
+        :return: sequence number, 0 if there are no messages yet
+        """
+        try:
+            db = db or await open_session()
+            result = await db.execute(
+                select(func.max(models.Message.seq)).filter(models.Message.room == room)
+            )
+            return result.scalar() or 0
+        except:
+            return 0
+        finally:
+            if db is not None:
+                await db.close()
+
+    @staticmethod
+    @timed(DB_LATENCY.labels("save_inbox_message"))
+    async def save_inbox_message(
+        sender_id: int,
+        recipient_id: int,
         message: str,
         date_time: datetime,
-        db: Session = SessionLocal(),
+        db: AsyncSession = None,
         *args,
         **kwargs
-    ) -> None:
+    ) -> int or None:
         """
-        Save user message
-        :param username: username
+        Save direct message to the inbox of the recipient,
+        it stays there until it is written to one of the recipient's sockets
+        :param sender_id: user_id of the sender
+        :param recipient_id: user_id of the recipient
         :param message: message
         :param date_time: date and time of the message
-        :param db: session
+        :param db: session, new one from the pool by default
         :param args: some args
         :param kwargs: some kwargs
-        :return: None
+        :return: inbox_id or None if not saved
         """
+        if not message:
+            return None
         try:
-            if not message or not username:
-                return
-            user = (
-                db.query(models.User).filter(models.User.username == username).first()
-            )
-            if not user:
-                return
-            user_id = user.user_id
-            db_message = models.Message(
-                owner_id=user_id, message=message, date_time=date_time
+            db = db or await open_session()
+            db_message = models.InboxMessage(
+                sender_id=sender_id,
+                recipient_id=recipient_id,
+                message=message,
+                date_time=date_time,
             )
             db.add(db_message)
-            db.commit()
+            await db.commit()
+            return db_message.inbox_id
+        except:
+            if db is not None:
+                await db.rollback()
+            return None
+        finally:
+            if db is not None:
+                await db.close()
+
+    @staticmethod
+    @timed(DB_LATENCY.labels("get_inbox_messages"))
+    async def get_inbox_messages(
+        recipient_id: int,
+        after: int = 0,
+        limit: int = DirectValues.INBOX_BATCH,
+        db: AsyncSession = None,
+        *args,
+        **kwargs
+    ) -> list:
+        """
+        Get undelivered direct messages of the recipient, oldest first.
+        Messages are not deleted here, see delete_inbox_messages()
+        :param recipient_id: user_id of the recipient
+        :param after: inbox_id of the last message of the previous page
+        :param limit: max messages
+        :param db: session, new one from the pool by default
+        :param args: some args
+        :param kwargs: some kwargs
+        :return: list of dicts with id, user (sender), message and date_time
+        """
+        query = (
+            select(
+                models.InboxMessage.inbox_id,
+                models.User.username,
+                models.InboxMessage.message,
+                models.InboxMessage.date_time,
+            )
+            .join(models.User, models.InboxMessage.sender_id == models.User.user_id)
+            .filter(
+                models.InboxMessage.recipient_id == recipient_id,
+                models.InboxMessage.inbox_id > after,
+            )
+            .order_by(models.InboxMessage.inbox_id)
+            .limit(limit)
+        )
+
+        try:
+            db = db or await open_session()
+            result = await db.execute(query)
+            return [
+                dict(id=inbox_id, user=username, message=message, date_time=date_time)
+                for inbox_id, username, message, date_time in result.all()
+            ]
+        except:
+            return []
+        finally:
+            if db is not None:
+                await db.close()
+
+    @staticmethod
+    @timed(DB_LATENCY.labels("delete_inbox_messages"))
+    async def delete_inbox_messages(
+        inbox_ids: list, db: AsyncSession = None, *args, **kwargs
+    ) -> None:
+        """
+        Delete delivered direct messages
+        :param inbox_ids: list of inbox_id
+        :param db: session, new one from the pool by default
+        :param args: some args
+        :param kwargs: some kwargs
+        :return: None
+        """
+        if not inbox_ids:
+            return
+        try:
+            db = db or await open_session()
+            await db.execute(
+                delete(models.InboxMessage).where(
+                    models.InboxMessage.inbox_id.in_(inbox_ids)
+                )
+            )
+            await db.commit()
         except:
-            db.rollback()
+            if db is not None:
+                await db.rollback()
         finally:
-            db.close()
+            if db is not None:
+                await db.close()
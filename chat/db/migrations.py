@@ -0,0 +1,25 @@
+from sqlalchemy import text
+
+from chat.db.base import Engine
+
+# Idempotent schema changes for databases created by earlier versions,
+# Base.metadata.create_all() creates missing tables only, not columns or indexes
+MIGRATIONS = [
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS room VARCHAR DEFAULT 'general'",
+    "CREATE INDEX IF NOT EXISTS ix_messages_room_date_time_id "
+    "ON messages (room, date_time, message_id)",
+    "CREATE INDEX IF NOT EXISTS ix_messages_owner_id ON messages (owner_id)",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq BIGINT",
+    "CREATE INDEX IF NOT EXISTS ix_messages_room_seq ON messages (room, seq)",
+]
+
+
+def migrate(engine=Engine) -> None:
+    """
+    Apply all migrations in one transaction
+    :param engine: database engine
+    :return: None
+    """
+    with engine.begin() as connection:
+        for statement in MIGRATIONS:
+            connection.execute(text(statement))
@@ -1,4 +1,12 @@
-from sqlalchemy import Column, String, DateTime, Integer, ForeignKey
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    String,
+    DateTime,
+    Integer,
+    ForeignKey,
+    Index,
+)
 from sqlalchemy.orm import relationship
 
 from chat.db.base import Base
@@ -26,12 +34,38 @@ class Message(Base):
     """
 
     __tablename__ = "messages"
+    __table_args__ = (
+        # Keyset pagination of the room history by (date_time, message_id)
+        Index("ix_messages_room_date_time_id", "room", "date_time", "message_id"),
+        Index("ix_messages_owner_id", "owner_id"),
+        # Replay of the room from the sequence number
+        Index("ix_messages_room_seq", "room", "seq"),
+    )
 
     message_id = Column(
         Integer, unique=True, index=True, primary_key=True, autoincrement=True
     )
     message = Column(String)
     date_time = Column(DateTime)
+    room = Column(String, default="general", server_default="general")
+    seq = Column(BigInteger)
 
     owner_id = Column(Integer, ForeignKey("users.user_id"))
     owner = relationship("User", back_populates="messages")
+
+
+class InboxMessage(Base):
+    """
+    Define table of direct messages to offline users,
+    rows are deleted once delivered
+    """
+
+    __tablename__ = "inbox"
+    __table_args__ = (Index("ix_inbox_recipient_id", "recipient_id", "inbox_id"),)
+
+    inbox_id = Column(Integer, primary_key=True, autoincrement=True)
+    message = Column(String)
+    date_time = Column(DateTime)
+
+    sender_id = Column(Integer, ForeignKey("users.user_id"))
+    recipient_id = Column(Integer, ForeignKey("users.user_id"))
@@ -0,0 +1,159 @@
+from asyncio import Condition, Queue, TimeoutError, get_event_loop, wait_for
+from datetime import datetime
+
+from chat.db.crud import DatabaseCrud
+from chat.utils.config import MessageWriterValues, RoomValues
+
+
+class MessageWriter:
+    """
+    Write-behind queue for chat messages.
+    Messages are collected into batches in the background and saved
+    with one INSERT per batch, so broadcasting never waits for the database.
+    """
+
+    def __init__(
+        self,
+        log,
+        batch_size: int = MessageWriterValues.BATCH_SIZE,
+        flush_interval: float = MessageWriterValues.FLUSH_INTERVAL,
+        queue_size: int = MessageWriterValues.QUEUE_SIZE,
+    ):
+        """
+        Init writer with batching options
+        :param log: logger to use
+        :param batch_size: max messages per one INSERT
+        :param flush_interval: max seconds to hold a non-empty batch
+        :param queue_size: max pending messages before put() starts to wait
+        """
+        self.log = log
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.queue = None
+        self._task = None
+        self._stopped = False
+        # Messages put and messages flushed (saved or dropped), to wait for
+        self._put = 0
+        self._done = 0
+        self._flushed = None
+
+    async def start(self, app=None) -> None:
+        """
+        Start background flush task (on_startup signal)
+        :param app: web app
+        :return: None
+        """
+        self.queue = Queue(maxsize=self.queue_size)
+        self._flushed = Condition()
+        self._stopped = False
+        self._task = get_event_loop().create_task(self._run())
+
+    async def stop(self, app=None) -> None:
+        """
+        Drain pending messages and stop background task (on_cleanup signal)
+        :param app: web app
+        :return: None
+        """
+        if self._task is None:
+            return
+        self._stopped = True
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+
+    async def put(
+        self,
+        owner_id: int,
+        message: str,
+        date_time: datetime,
+        room: str = RoomValues.DEFAULT_ROOM,
+        seq: int = None,
+    ) -> None:
+        """
+        Enqueue message to save, wait for a free slot if the queue is full.
+        After stop() nobody reads the queue, the message is saved right away
+        :param owner_id: user_id of the sender
+        :param message: message content
+        :param date_time: date and time of the message
+        :param room: room name
+        :param seq: sequence number of the message in the room
+        :return: None
+        """
+        item = {
+            "owner_id": owner_id,
+            "message": message,
+            "date_time": date_time,
+            "room": room,
+            "seq": seq,
+        }
+        if self._stopped:
+            await self._flush([item])
+            return
+        await self.queue.put(item)
+        self._put += 1
+
+    async def wait_flushed(self) -> None:
+        """
+        Wait until the messages put before the call are flushed
+        (saved, or dropped if the database rejected them)
+        :return: None
+        """
+        if self._task is None:
+            return
+        target = self._put
+        async with self._flushed:
+            await self._flushed.wait_for(lambda: self._done >= target)
+
+    async def _run(self) -> None:
+        """
+        Collect messages into batches, flush them by size or by time
+        :return: None
+        """
+        loop = get_event_loop()
+        running = True
+        while running:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await wait_for(self.queue.get(), timeout=timeout)
+                except TimeoutError:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            async with self._flushed:
+                self._done += len(batch)
+                self._flushed.notify_all()
+
+    async def _flush(self, batch: list) -> None:
+        """
+        Save batch with one INSERT. If it fails, save both halves separately,
+        so one bad row loses only itself, not the whole batch
+        :param batch: list of messages
+        :return: None
+        """
+        try:
+            saved = await DatabaseCrud.save_messages(batch)
+        except Exception as error:
+            # No connection, splitting the batch won't help
+            self.log.error(f"Failed to save {len(batch)} messages: {error}")
+            return
+        if saved:
+            return
+        if len(batch) == 1:
+            self.log.error(f"Dropped message of user {batch[0].get('owner_id')}")
+            return
+        self.log.warning(f"Failed to save batch of {len(batch)} messages, split it")
+        middle = len(batch) // 2
+        await self._flush(batch[:middle])
+        await self._flush(batch[middle:])
@@ -11,4 +11,4 @@ class Chat:
         :param request: GET request from user
         :return: static page "chat.html"
         """
-        return Serve.serve_static("chat.html")
+        return await Serve.serve_static("chat.html", request)
@@ -1,7 +1,8 @@
 from aiohttp import web
 from aiohttp_csrf import generate_token
 
-from chat.utils.config import DefaultPaths, CSRFCongiruation
+from chat.utils.config import CSRFCongiruation
+from chat.utils.serve import assets
 
 
 class Feedback(web.View):
@@ -11,12 +12,10 @@ class Feedback(web.View):
         :return: static page "feedback.html"
         """
         token = await generate_token(self.request)
-        with open(
-            file=DefaultPaths.STATIC_TEMPLATES / "feedback.html", mode="r"
-        ) as template:
-            body = template.read()
-        body = body.format(field_name=CSRFCongiruation.FORM_FIELD_NAME, token=token)
-        return web.Response(text=body, content_type="text/html")
+        head, tail = await assets.split(
+            "feedback.html", "token", field_name=CSRFCongiruation.FORM_FIELD_NAME
+        )
+        return web.Response(text=head + token + tail, content_type="text/html")
 
     async def post(self):
         """
@@ -0,0 +1,85 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from chat.db.crud import DatabaseCrud
+from chat.middlewares.auth import login_required
+from chat.utils.config import HistoryValues, RoomValues
+from chat.utils.response import Responses
+from chat.ws.messages import chat_message
+from chat.ws.rooms import valid_room
+
+
+def encode_cursor(date_time: datetime, message_id: int) -> str:
+    """
+    Encode keyset cursor of the message
+    :param date_time: date and time of the message
+    :param message_id: message id
+    :return: opaque cursor
+    """
+    cursor = f"{date_time.isoformat()}|{message_id}".encode("utf-8")
+    return urlsafe_b64encode(cursor).decode("utf-8")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Decode keyset cursor
+    :param cursor: opaque cursor from encode_cursor()
+    :return: (date_time, message_id)
+    """
+    date_time, message_id = (
+        urlsafe_b64decode(cursor.encode("utf-8")).decode("utf-8").split("|")
+    )
+    return datetime.fromisoformat(date_time), int(message_id)
+
+
+class History:
+    """
+    Handle message history
+    """
+
+    @staticmethod
+    @login_required
+    async def get(request):
+        """
+        Handle REST API requests to "/api/chat/history"
+
+        Return one page of the room history, newest first. Query parameters:
+        "room" (default room if not set), "limit" and "cursor" - the "next_cursor"
+        value from the previous page to continue scrolling back.
+
+        :param request: GET request from user
+        :return: JSON response
+        """
+        room = request.query.get("room", RoomValues.DEFAULT_ROOM)
+        if not valid_room(room):
+            return Responses.error("Wrong room name")
+        try:
+            limit = int(request.query.get("limit", HistoryValues.PAGE_SIZE))
+            cursor = request.query.get("cursor")
+            before = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            return Responses.error("Wrong limit or cursor")
+        limit = max(1, min(limit, HistoryValues.MAX_PAGE_SIZE))
+
+        messages = await DatabaseCrud.get_messages(room, before=before, limit=limit)
+        next_cursor = None
+        if len(messages) == limit:
+            next_cursor = encode_cursor(messages[-1]["date_time"], messages[-1]["id"])
+        return Responses.response(
+            "success",
+            "success",
+            200,
+            additional={
+                "messages": [
+                    chat_message(
+                        message["user"],
+                        message["message"],
+                        message["date_time"],
+                        room,
+                        message["seq"],
+                    )
+                    for message in messages
+                ],
+                "next_cursor": next_cursor,
+            },
+        )
@@ -9,4 +9,4 @@ class Home:
         :param request: GET request from user
         :return: static page "home.html"
         """
-        return Serve.serve_static("home.html")
+        return await Serve.serve_static("home.html", request)
@@ -1,8 +1,9 @@
 from chat.db.crud import DatabaseCrud
-from chat.middlewares.auth import cache
-from chat.middlewares.auth import decode_token, check_cache
+from chat.middlewares.auth import jti_cache
 from chat.middlewares.auth import get_token, get_jti
 from chat.schemas.user import validate
+from chat.utils.passwords import HashingUnavailable
+from chat.utils.ratelimit import client_address, login_limiter
 from chat.utils.response import Responses
 from chat.utils.serve import Serve
 
@@ -19,7 +20,7 @@ class Login:
         :param request: GET request from user
         :return: static page "login.html"
         """
-        return Serve.serve_static("login.html")
+        return await Serve.serve_static("login.html", request)
 
     @staticmethod
     async def post(request):
@@ -35,27 +36,28 @@ class Login:
         :param request: POST request in JSON representation
         :return: JSON response
         """
+        # Every attempt costs an Argon2 verification, throttle per client IP
+        if not await login_limiter.allow(client_address(request)):
+            return Responses.too_many()
         credentials = await request.json()
         username = credentials.get("username")
         password = credentials.get("password")
         if not validate(username, password):
             return Responses.validation_error()
 
-        # Check if already logged in
+        # Check if already logged in, auth_middleware has verified the token
+        if request.jwt_payload is not None:
+            return Responses.error("Already logged in, log out")
+
         try:
-            jwt_token = request.headers.get("Authorization")
-            jwt_token = jwt_token.split(" ")[1]
-            payload = decode_token(jwt_token)
-            if check_cache(payload) is True:
-                return Responses.error("Already logged in, log out")
-        except Exception:
-            pass
-
-        if not DatabaseCrud.check_credentials(username, password):
-            return Responses.error("Wrong username or password")
+            if not await DatabaseCrud.check_credentials(username, password):
+                return Responses.error("Wrong username or password")
+        except HashingUnavailable:
+            return Responses.busy()
         jti = get_jti()
-        jwt_token = get_token(username, jti)
-        cache.set(key=username, value=jti)
+        user_id = await DatabaseCrud.get_user_id(username)
+        jwt_token = get_token(username, jti, user_id)
+        await jti_cache.set(username, jti)
         return Responses.success_token(
             jwt_token, username, message="Successfully logged in"
         )
@@ -0,0 +1,17 @@
+from aiohttp import web
+
+from chat.utils.metrics import REGISTRY
+
+
+class Metrics:
+    @staticmethod
+    async def get(request):
+        """
+        Export application metrics in Prometheus text format
+        :param request: GET request from the scraper
+        :return: text response
+        """
+        return web.Response(
+            text=REGISTRY.render(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
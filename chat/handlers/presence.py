@@ -0,0 +1,31 @@
+from aiohttp import web
+
+from chat.utils.response import Responses
+
+
+class Presence:
+    """
+    Handle online users
+    """
+
+    def __init__(self, presence):
+        """
+        Init handler
+        :param presence: online users tracker (PresenceService)
+        """
+        self.presence = presence
+
+    async def get(self, request):
+        """
+        Handle REST API requests to "/api/chat/presence"
+        :param request: GET request from user
+        :return: JSON response with online usernames
+        """
+        if not request.user:
+            return web.HTTPUnauthorized()
+        return Responses.response(
+            "success",
+            "success",
+            200,
+            additional={"users": await self.presence.online()},
+        )
@@ -1,5 +1,7 @@
 from chat.db.crud import DatabaseCrud
 from chat.schemas.user import validate
+from chat.utils.passwords import HashingUnavailable
+from chat.utils.ratelimit import client_address, register_limiter
 from chat.utils.response import Responses
 from chat.utils.serve import Serve
 
@@ -16,7 +18,7 @@ class Register:
         :param request: GET request from user
         :return: static page "register.html"
         """
-        return Serve.serve_static("register.html")
+        return await Serve.serve_static("register.html", request)
 
     @staticmethod
     async def post(request):
@@ -30,13 +32,19 @@ class Register:
         :param request: POST request in JSON representation
         :return: JSON response
         """
+        # Every user costs an Argon2 hash, throttle per client IP
+        if not await register_limiter.allow(client_address(request)):
+            return Responses.too_many()
         credentials = await request.json()
         username = credentials.get("username")
         password = credentials.get("password")
         if not validate(username, password):
             return Responses.validation_error()
 
-        if DatabaseCrud.check_user_exists(username):
+        if await DatabaseCrud.check_user_exists(username):
             return Responses.error("User already exists")
-        DatabaseCrud.create_user(username, password)
+        try:
+            await DatabaseCrud.create_user(username, password)
+        except HashingUnavailable:
+            return Responses.busy()
         return Responses.success("User successfully created")
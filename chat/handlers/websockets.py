@@ -1,14 +1,68 @@
-from asyncio import wait
-from collections import deque
+from asyncio import (
+    CancelledError,
+    TimeoutError,
+    ensure_future,
+    get_event_loop,
+    sleep,
+    wait,
+    wait_for,
+)
 from datetime import datetime
-from json import dumps, loads
+from functools import partial
+from random import randint
+from time import monotonic, perf_counter
 
-from aiohttp import WSMsgType
-from aiohttp import web
+from aiohttp import WSCloseCode, WSMsgType
 
 from chat.db.crud import DatabaseCrud
 from chat.middlewares.auth import decode_token, check_cache
-from chat.utils.config import ServiceConfiguration
+from chat.utils.codec import dumps, loads
+from chat.utils.config import (
+    DirectValues,
+    DrainValues,
+    HeartbeatValues,
+    HistoryValues,
+    MessageValues,
+    RoomValues,
+    ServiceConfiguration,
+)
+from chat.utils.metrics import (
+    BROADCAST_FANOUT,
+    CLIENT_QUEUE_DEPTH,
+    CLIENT_QUEUE_MAX_DEPTH,
+    CONNECTIONS_REAPED,
+    MESSAGES,
+    WEBSOCKET_CONNECTIONS,
+)
+from chat.utils.ratelimit import message_limiter
+from chat.utils.response import Responses
+from chat.ws.client import ClientConnection
+from chat.ws.compression import WebSocketResponse
+from chat.ws.frames import Frame
+from chat.ws.messages import chat_message, direct_message
+from chat.ws.registry import ConnectionRegistry
+from chat.ws.rooms import RoomIndex, valid_room
+
+
+def last_seq(message_json: dict) -> int or None:
+    """
+    Get "last_seq" of the resuming client from the auth or join message
+    :param message_json: decoded message
+    :return: sequence number or None
+    """
+    seq = message_json.get("last_seq")
+    if isinstance(seq, int) and not isinstance(seq, bool) and seq >= 0:
+        return seq
+    return None
+
+
+def valid_message(message) -> bool:
+    """
+    Check message content: non-empty string not longer than the limit
+    :param message: message content from the client
+    :return: True or False
+    """
+    return isinstance(message, str) and 0 < len(message) <= MessageValues.MAX_LENGTH
 
 
 class WebSockets:
@@ -16,32 +70,471 @@ class WebSockets:
     Manage WebSockets
     """
 
-    def __init__(self, log):
+    def __init__(self, log, writer, backend, presence):
         """
-        Save session_history, store 10 messages and show them from history,
-        manage current WebSocket connections.
+        Manage current WebSocket connections of this worker and their rooms,
+        messages and recent history are shared through the broadcast backend.
         :param log: logger to use
+        :param writer: background message writer (MessageWriter)
+        :param backend: broadcast backend (BroadcastBackend)
+        :param presence: online users tracker (PresenceService)
         """
-        self.session_history = deque(maxlen=10)
-        self.session_websockets = []
+        self.session_websockets = ConnectionRegistry()
+        self.rooms = RoomIndex()
+        self.draining = False
+        self._reaper = None
         self.log = log
+        self.writer = writer
+        self.backend = backend
+        self.presence = presence
+        self.backend.subscribe(self.__deliver)
+        WEBSOCKET_CONNECTIONS.set_function(lambda: len(self.session_websockets))
+        CLIENT_QUEUE_DEPTH.set_function(lambda: sum(self.__queue_depths()))
+        # One slow consumer is lost in the sum
+        CLIENT_QUEUE_MAX_DEPTH.set_function(
+            lambda: max(self.__queue_depths(), default=0)
+        )
+
+    def __queue_depths(self):
+        """
+        Outbound queue depth of every connected client
+        :return: generator of depths
+        """
+        return (
+            client.depth for shard in self.session_websockets.shards for client in shard
+        )
 
-    async def __send_to_all(self, username: str, message: str) -> None:
+    async def __send_to_all(
+        self,
+        username: str,
+        message: str,
+        room: str = RoomValues.DEFAULT_ROOM,
+        user_id: int = None,
+    ) -> None:
         """
-        Send message to everybody (basic send function)
+        Send message to everybody in the room (basic send function)
         :param username: username of the sender
         :param message: message content of the sender
+        :param room: room name
+        :param user_id: user_id of the sender, server messages are not saved
+            and have no sequence number
+        :return: None
+        """
+        date_time = datetime.now()
+        seq = await self.backend.next_seq(room) if user_id is not None else None
+        await self.backend.publish(
+            room, dumps(chat_message(username, message, date_time, room, seq))
+        )
+
+        # Persist in the background, waits only if the write queue is full
+        if user_id is not None:
+            MESSAGES.inc()
+            await self.writer.put(
+                user_id, message, date_time=date_time, room=room, seq=seq
+            )
+
+    def __deliver(self, room: str, payload: bytes) -> None:
+        """
+        Deliver broadcast message to the clients of this worker in the room.
+        The frame is built once and the same bytes are written to every client.
+        :param room: room name, or "@<username>" for direct messages
+        :param payload: UTF-8 encoded JSON message
+        :return: None
+        """
+        on_sent = None
+        if room.startswith("@"):
+            subscribers = self.session_websockets.user(room[1:])
+            if subscribers:
+                message = loads(payload)
+                if message.get("id") is not None and message.get("to") == room[1:]:
+                    on_sent = self.__acknowledge(message["id"])
+        else:
+            subscribers = self.rooms.subscribers(room)
+        if not subscribers:
+            return
+        started = perf_counter()
+        frame = Frame(payload, on_sent)
+        # Only enqueue here, every client has its own writer task
+        for client in subscribers:
+            client.send(frame)
+        BROADCAST_FANOUT.observe(perf_counter() - started)
+
+    @staticmethod
+    def __notify(connection, message: str, room: str) -> None:
+        """
+        Send server message to one connection only
+        :param connection: connection (ClientConnection)
+        :param message: message content
+        :param room: room name
         :return: None
         """
-        chat_message = dumps(
-            {"user": username, "message": message, "time": f"{datetime.now():%H:%M:%S}"}
+        connection.send(
+            Frame(dumps(chat_message("server", message, datetime.now(), room)))
         )
-        self.session_history.append(chat_message)
-        DatabaseCrud.save_message(username, message, date_time=datetime.now())
 
-        futures = [client.send_str(chat_message) for client in self.session_websockets]
-        if futures:
-            await wait(futures)
+    async def __join(self, connection, room: str, last_seq: int = None) -> None:
+        """
+        Subscribe connection to the room and send the room history,
+        or only the messages after last_seq if the client resumes the session
+        :param connection: connection (ClientConnection)
+        :param room: room name
+        :param last_seq: sequence number of the last message the client has seen
+        :return: None
+        """
+        if room in connection.rooms:
+            return
+        if last_seq is not None:
+            # Hold live messages until the gap is sent, then skip duplicates
+            connection.hold()
+        if not self.rooms.join(room, connection):
+            connection.release()
+            self.__notify(connection, "Too many rooms, leave one first", room)
+            return
+        if last_seq is not None:
+            frames, replayed = [], last_seq
+            try:
+                frames, replayed = await self.__replay(room, last_seq)
+            finally:
+                held = connection.release()
+                for frame in frames:
+                    connection.send(frame)
+                for frame in held:
+                    message = loads(frame.payload)
+                    seq = message.get("seq")
+                    if message.get("room") != room or seq is None or seq > replayed:
+                        connection.send(frame)
+        elif HistoryValues.SOURCE == "database":
+            messages = await DatabaseCrud.get_messages(
+                room, limit=HistoryValues.BACKLOG
+            )
+            for message in reversed(messages):
+                payload = dumps(
+                    chat_message(
+                        message["user"],
+                        message["message"],
+                        message["date_time"],
+                        room,
+                        message["seq"],
+                    )
+                )
+                connection.send(Frame(payload))
+        else:
+            for payload in await self.backend.history(room):
+                connection.send(Frame(payload))
+
+    async def __replay(self, room: str, last_seq: int) -> tuple:
+        """
+        Get the messages of the room after last_seq, oldest first: from the
+        broadcast backend ring if it still has the next message after last_seq,
+        else from the database (plus the newest ones not saved yet from the ring).
+        Messages that are in neither (queued by the writer of another worker,
+        or not saved in time) are replaced with a notice to use the history API
+        :param room: room name
+        :param last_seq: sequence number of the last message the client has seen
+        :return: (list of frames, sequence number of the last message in them)
+        """
+        frames = []
+        recent = []
+        oldest = None
+        for payload in await self.backend.history(room):
+            seq = loads(payload).get("seq")
+            if seq is None:
+                continue
+            if oldest is None:
+                oldest = seq
+            if seq > last_seq:
+                recent.append((seq, payload))
+
+        if oldest is None or oldest > last_seq + 1:
+            # The missed messages may still be waiting in the writer queue
+            try:
+                await wait_for(
+                    self.writer.wait_flushed(), timeout=HistoryValues.REPLAY_WAIT
+                )
+            except TimeoutError:
+                self.log.warning(f"Replay of {room} didn't wait for unsaved messages")
+            messages = await DatabaseCrud.get_messages_since(
+                room, last_seq, limit=HistoryValues.REPLAY_LIMIT
+            )
+            for message in messages:
+                payload = dumps(
+                    chat_message(
+                        message["user"],
+                        message["message"],
+                        message["date_time"],
+                        room,
+                        message["seq"],
+                    )
+                )
+                frames.append(Frame(payload))
+                last_seq = message["seq"]
+            if len(messages) == HistoryValues.REPLAY_LIMIT:
+                notice = "Too many missed messages, use the history API"
+                frames.append(
+                    Frame(dumps(chat_message("server", notice, datetime.now(), room)))
+                )
+                return frames, last_seq
+            following = [seq for seq, payload in recent if seq > last_seq]
+            if following and following[0] > last_seq + 1:
+                notice = "Some missed messages are not saved yet, use the history API"
+                frames.append(
+                    Frame(dumps(chat_message("server", notice, datetime.now(), room)))
+                )
+
+        for seq, payload in recent:
+            if seq > last_seq:
+                frames.append(Frame(payload))
+                last_seq = seq
+        return frames, last_seq
+
+    async def __direct(self, connection, message_json: dict) -> None:
+        """
+        Send direct message to the connections of the recipient only.
+        The message is saved to the inbox of the recipient first and deleted
+        once it is written to one of the recipient's sockets, so it is sent
+        on the next connection if the recipient is offline or disconnects
+        before it is written. The other connections of the sender get a copy too.
+        :param connection: connection of the sender (ClientConnection)
+        :param message_json: {"type": "direct", "to": ..., "message": ...}
+        :return: None
+        """
+        recipient = message_json.get("to")
+        message = message_json.get("message")
+        if not isinstance(recipient, str) or not valid_message(message):
+            self.__notify(connection, "Wrong direct message", RoomValues.DEFAULT_ROOM)
+            return
+        recipient_id = await DatabaseCrud.get_user_id(recipient)
+        if recipient_id is None:
+            self.__notify(connection, "No such user", RoomValues.DEFAULT_ROOM)
+            return
+
+        date_time = datetime.now()
+        inbox_id = await DatabaseCrud.save_inbox_message(
+            connection.user_id, recipient_id, message, date_time
+        )
+        await self.backend.announce(
+            f"@{recipient}",
+            dumps(
+                direct_message(
+                    connection.username, recipient, message, date_time, inbox_id
+                )
+            ),
+        )
+        if recipient != connection.username:
+            await self.backend.announce(
+                f"@{connection.username}",
+                dumps(
+                    direct_message(connection.username, recipient, message, date_time)
+                ),
+            )
+
+    @staticmethod
+    def __acknowledge(inbox_id: int):
+        """
+        Create on_sent callback of a direct message frame:
+        delete the message from the inbox after the first successful write
+        :param inbox_id: inbox id of the message
+        :return: callback
+        """
+        pending = [inbox_id]
+
+        def on_sent():
+            if pending:
+                ensure_future(DatabaseCrud.delete_inbox_messages([pending.pop()]))
+
+        return on_sent
+
+    @staticmethod
+    async def __send_inbox(connection) -> None:
+        """
+        Send direct messages received while the user was offline, page by page.
+        Messages are deleted from the inbox only after they are written.
+        :param connection: connection (ClientConnection)
+        :return: None
+        """
+        after = 0
+        while not connection.closed:
+            messages = await DatabaseCrud.get_inbox_messages(
+                connection.user_id, after=after, limit=DirectValues.INBOX_BATCH
+            )
+            sent = []
+            for message in messages:
+                payload = dumps(
+                    direct_message(
+                        message["user"],
+                        connection.username,
+                        message["message"],
+                        message["date_time"],
+                        message["id"],
+                    )
+                )
+                connection.send(Frame(payload, partial(sent.append, message["id"])))
+            await connection.drain()
+            await DatabaseCrud.delete_inbox_messages(sent)
+            if len(messages) < DirectValues.INBOX_BATCH:
+                return
+            after = messages[-1]["id"]
+
+    async def __handle(self, connection, message_json: dict) -> None:
+        """
+        Handle protocol message from the client:
+        {"type": "join" | "leave", "room": ...} to manage rooms,
+        {"message": ..., "room": ...} to send message to the joined room,
+        {"type": "direct", "to": ..., "message": ...} to send message to one user
+        :param connection: connection (ClientConnection)
+        :param message_json: decoded message
+        :return: None
+        """
+        message_type = message_json.get("type", "message")
+        if self.draining and message_type in ("message", "direct"):
+            # The writer is being stopped, the message could not be saved
+            self.__notify(
+                connection,
+                "Server is shutting down, message not sent",
+                RoomValues.DEFAULT_ROOM,
+            )
+            return
+        if message_type == "direct":
+            if not await message_limiter.allow(connection.username):
+                self.__notify(
+                    connection, "Too many messages, slow down", RoomValues.DEFAULT_ROOM
+                )
+            else:
+                await self.__direct(connection, message_json)
+            return
+
+        room = message_json.get("room", RoomValues.DEFAULT_ROOM)
+        if not valid_room(room):
+            self.__notify(connection, "Wrong room name", RoomValues.DEFAULT_ROOM)
+            return
+
+        if message_type == "join":
+            await self.__join(connection, room, last_seq(message_json))
+        elif message_type == "leave":
+            self.rooms.leave(room, connection)
+        elif room not in connection.rooms:
+            self.__notify(connection, "Join the room first", room)
+        elif not valid_message(message_json.get("message")):
+            self.__notify(connection, "Wrong message", room)
+        elif not await message_limiter.allow(connection.username):
+            self.__notify(connection, "Too many messages, slow down", room)
+        else:
+            await self.__send_to_all(
+                connection.username,
+                message_json.get("message"),
+                room,
+                user_id=connection.user_id,
+            )
+
+    @staticmethod
+    async def __drain(connection) -> None:
+        """
+        Flush pending messages of the connection and close it with
+        "service restart" code and a jittered reconnect delay in ms
+        :param connection: connection (ClientConnection)
+        :return: None
+        """
+        await connection.drain()
+        delay = DrainValues.RECONNECT_MIN_MS + randint(
+            0, DrainValues.RECONNECT_JITTER_MS
+        )
+        await connection.websocket.close(
+            code=WSCloseCode.SERVICE_RESTART, message=dumps({"reconnect_after": delay})
+        )
+
+    async def shutdown(self, app=None) -> None:
+        """
+        Drain connections (on_shutdown signal): refuse new sockets and new chat
+        messages, close current connections after their queues are flushed,
+        then save pending messages, everything within the shutdown deadline
+        :param app: web app
+        :return: None
+        """
+        self.draining = True
+        loop = get_event_loop()
+        deadline = loop.time() + DrainValues.DEADLINE
+        connections = list(self.session_websockets)
+        if connections:
+            self.log.info(f"Drain {len(connections)} WebSocket connections")
+            _, pending = await wait(
+                [ensure_future(self.__drain(connection)) for connection in connections],
+                timeout=DrainValues.DEADLINE,
+            )
+            if pending:
+                self.log.warning(f"{len(pending)} connections were not drained in time")
+        # Not cancelled on timeout, the writer is stopped again on cleanup
+        _, pending = await wait(
+            [ensure_future(self.writer.stop())],
+            timeout=max(0.0, deadline - loop.time()),
+        )
+        if pending:
+            self.log.warning("Pending messages were not saved in time")
+
+    async def start(self, app=None) -> None:
+        """
+        Start reaper of dead and idle connections (on_startup signal)
+        :param app: web app
+        :return: None
+        """
+        if HeartbeatValues.REAPER_INTERVAL:
+            self._reaper = get_event_loop().create_task(self.__reap())
+
+    async def stop(self, app=None) -> None:
+        """
+        Stop reaper (on_cleanup signal)
+        :param app: web app
+        :return: None
+        """
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except CancelledError:
+                pass
+            self._reaper = None
+
+    async def __reap(self) -> None:
+        """
+        Periodically close connections that are already dead (closed socket,
+        failed writer) but still registered, and idle ones
+        :return: None
+        """
+        while True:
+            await sleep(HeartbeatValues.REAPER_INTERVAL)
+            for shard in self.session_websockets.shards:
+                self.__reap_shard(list(shard))
+                # Don't block the loop for the whole registry at once
+                await sleep(0)
+
+    def __reap_shard(self, connections: list) -> None:
+        """
+        Close dead and idle connections of one registry shard
+        :param connections: connections of the shard
+        :return: None
+        """
+        now = monotonic()
+        for connection in connections:
+            if connection.reaped:
+                # Already closing, the handler hasn't unregistered it yet
+                continue
+            if connection.closed:
+                reason = "dead"
+            elif (
+                HeartbeatValues.IDLE_TIMEOUT
+                and now - connection.last_seen > HeartbeatValues.IDLE_TIMEOUT
+            ):
+                reason = "idle"
+            else:
+                continue
+            connection.reaped = True
+            CONNECTIONS_REAPED.labels(reason).inc()
+            self.log.info(f"Reap {reason} connection of {connection.username}")
+            # Closing ends the receive loop of the handler, which cleans up
+            ensure_future(
+                connection.websocket.close(
+                    code=WSCloseCode.GOING_AWAY, message=reason.encode("utf-8")
+                )
+            )
 
     async def get(self, request):
         """
@@ -49,6 +542,9 @@ class WebSockets:
         :param request: WS connection request from browser
         :return: WS connection
         """
+        if self.draining:
+            return Responses.busy("Server is shutting down, try again later")
+
         # Check request origin, just in case
         origin = request.headers.get("origin")
         if not any(
@@ -62,45 +558,70 @@ class WebSockets:
             return
 
         # Origin check passed, check JWT token from first auth-message
-        client = web.WebSocketResponse()
+        client = WebSocketResponse(heartbeat=HeartbeatValues.HEARTBEAT or None)
         await client.prepare(request)
 
         try:
-            auth = await client.receive_str()
+            auth = await client.receive_str(
+                timeout=HeartbeatValues.HANDSHAKE_TIMEOUT or None
+            )
             auth_message = loads(auth)
+            resume_from = last_seq(auth_message)
             auth_token = auth_message.get("token")
             auth_message = auth_message.get("message")
             assert auth_message == "auth"
             payload = decode_token(auth_token)
-            if check_cache(payload) is False:
+            if await check_cache(payload) is False:
                 raise ValueError("Token is not active")
             username = payload.get("name", "unknown")
+            # Tokens issued before user_id was added to the payload
+            user_id = payload.get("uid") or await DatabaseCrud.get_user_id(username)
 
+        except TimeoutError:
+            CONNECTIONS_REAPED.labels("handshake").inc()
+            self.log.error("No auth message in time")
+            await client.close(
+                code=WSCloseCode.POLICY_VIOLATION, message=b"Handshake timeout"
+            )
+            return client
         except:
             message = "Not authorized"
             await client.send_str(message)
             self.log.error(message)
-            return
-
-        await self.__send_to_all("server", f"User {username} joined the server")
-
-        for chat_message in self.session_history:
-            await client.send_str(chat_message)
+            return client
 
-        self.session_websockets.append(client)
+        connection = ClientConnection(client, username, self.log, user_id=user_id)
+        connection.start()
+        self.session_websockets.add(connection)
+        self.presence.update(username, len(self.session_websockets.user(username)))
+        await self.__join(connection, RoomValues.DEFAULT_ROOM, resume_from)
+        await self.__send_inbox(connection)
 
         try:
             async for message in client:
                 if message.type == WSMsgType.TEXT:
-                    message_data = message.data.encode("utf-8")
-                    message_json = loads(message_data)
-                    message_text = message_json.get("message")
-                    await self.__send_to_all(username, message_text)
+                    connection.last_seen = monotonic()
+                    try:
+                        message_json = loads(message.data)
+                    except ValueError:
+                        message_json = None
+                    if not isinstance(message_json, dict):
+                        self.__notify(
+                            connection, "Wrong message format", RoomValues.DEFAULT_ROOM
+                        )
+                        continue
+                    await self.__handle(connection, message_json)
                 elif message.type == WSMsgType.ERROR:
                     self.log.error(
                         f"WebSocket connection closed with exception: {client.exception()}"
                     )
         finally:
-            self.session_websockets.remove(client)
+            self.rooms.leave_all(connection)
+            self.session_websockets.remove(connection)
+            self.presence.update(username, len(self.session_websockets.user(username)))
+            await connection.close()
 
-        await self.__send_to_all("server", f"User {username} left the server")
+        # No pong in time, the connection is closed by the heartbeat
+        if not connection.reaped and isinstance(client.exception(), TimeoutError):
+            CONNECTIONS_REAPED.labels("heartbeat").inc()
+        return client
@@ -1,32 +1,144 @@
+import logging
 from datetime import datetime, timedelta
+from hashlib import sha256
+from time import time
 
 import jwt
 from aiohttp import web
 
+from chat.cache.local import LocalCache
+from chat.cache.revocation import JTICache
 from chat.cache.storage import RedisCache
 from chat.utils.config import JWTConfiguration
 from chat.utils.helpers import generate_random
 
-# Init redis connection
+# Init redis cache, the pool is created on app startup
 cache = RedisCache()
+jti_cache = JTICache(cache, logging.getLogger(__name__))
+# Token digest -> verified payload, every entry lives until the token expires
+verified_tokens = LocalCache(size=JWTConfiguration.JWT_MEMO_SIZE, ttl=0)
+
+
+def load_key(path: str, private: bool):
+    """
+    Load PEM key from file
+    :param path: file path
+    :param private: private (signing) or public (verification) key
+    :return: key object
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.serialization import (
+        load_pem_private_key,
+        load_pem_public_key,
+    )
+
+    with open(path, "rb") as key_file:
+        data = key_file.read()
+    if private:
+        return load_pem_private_key(data, password=None, backend=default_backend())
+    return load_pem_public_key(data, backend=default_backend())
+
+
+class TokenKeys:
+    """
+    JWT signing and verification keys. PEM keys are parsed once on startup,
+    not on every token, and passed to PyJWT as key objects.
+    """
+
+    def __init__(
+        self,
+        algorithm: str = JWTConfiguration.JWT_ALGORITHM,
+        secret: str = JWTConfiguration.JWT_SECRET,
+        private_key_file: str = JWTConfiguration.JWT_PRIVATE_KEY_FILE,
+        public_key_file: str = JWTConfiguration.JWT_PUBLIC_KEY_FILE,
+    ):
+        """
+        Init keys
+        :param algorithm: JWT algorithm
+        :param secret: shared secret of HS* algorithms
+        :param private_key_file: PEM private key of asymmetric algorithms (to sign)
+        :param public_key_file: PEM public key of asymmetric algorithms (to verify)
+        """
+        self.algorithm = algorithm
+        self.secret = secret
+        self.private_key_file = private_key_file
+        self.public_key_file = public_key_file
+        self.signing = None
+        self.verification = None
+        self.loaded = False
+
+    async def load(self, app=None) -> None:
+        """
+        Load keys (on_startup signal)
+        :param app: web app
+        :return: None
+        """
+        self.load_keys()
+
+    def load_keys(self) -> None:
+        """
+        Load keys, fail early on unsupported algorithm or missing key
+        :return: None
+        """
+        if self.algorithm not in jwt.algorithms.get_default_algorithms():
+            raise ValueError(f"JWT algorithm {self.algorithm} is not supported")
+        if self.algorithm.startswith("HS"):
+            self.signing = self.verification = self.secret
+        else:
+            if not self.public_key_file:
+                raise ValueError(
+                    f"JWT_PUBLIC_KEY_FILE is required for {self.algorithm}"
+                )
+            self.verification = load_key(self.public_key_file, private=False)
+            # Verification only workers don't have the private key
+            if self.private_key_file:
+                self.signing = load_key(self.private_key_file, private=True)
+        self.loaded = True
+
+    def signing_key(self):
+        if not self.loaded:
+            self.load_keys()
+        if self.signing is None:
+            raise ValueError("JWT_PRIVATE_KEY_FILE is required to issue tokens")
+        return self.signing
+
+    def verification_key(self):
+        if not self.loaded:
+            self.load_keys()
+        return self.verification
+
+
+keys = TokenKeys()
 
 
 def decode_token(jwt_token):
     """
-    Decode and verify (iat, exp, sign, etc.) JWT token
+    Decode and verify (iat, exp, sign, etc.) JWT token.
+    Verified tokens are remembered by digest until they expire,
+    so the same token is parsed and verified only once.
     :param jwt_token: JWT token to decode in str representation
     :return: decoded JWT token
     """
-    return jwt.decode(
+    digest = None
+    if isinstance(jwt_token, str):
+        digest = sha256(jwt_token.encode("utf-8")).digest()
+        payload = verified_tokens.get(digest)
+        if payload is not None:
+            return payload
+    payload = jwt.decode(
         jwt=jwt_token,
-        key=JWTConfiguration.JWT_SECRET,
-        algorithms=[JWTConfiguration.JWT_ALGORITHM],
+        key=keys.verification_key(),
+        algorithms=[keys.algorithm],
         verify=True,
         options={"verify_iat": True, "verify_exp": True},
     )
+    lifetime = payload.get("exp", 0) - time()
+    if digest is not None and lifetime > 0:
+        verified_tokens.set(digest, payload, ttl=lifetime)
+    return payload
 
 
-def check_cache(payload):
+async def check_cache(payload):
     """
     Check that this username with this JTI exists in cache, and active
     :param payload: payload to user as a base
@@ -34,8 +146,8 @@ def check_cache(payload):
     """
     username = payload.get("name")
     jti = payload.get("jti")
-    jti_cache = cache.get(username).decode(encoding="utf-8")
-    if jti != jti_cache:
+    active_jti = await jti_cache.get(username)
+    if active_jti is None or jti != active_jti:
         return False
     return True
 
@@ -50,20 +162,23 @@ async def auth_middleware(app, handler):
 
     async def middleware(request):
         request.user = None
+        # Verified payload of the active token, handlers don't decode it again
+        request.jwt_payload = None
         jwt_token = request.headers.get("Authorization")
         if jwt_token:
             jwt_token = jwt_token.split(" ")[1]
         if jwt_token:
             try:
                 payload = decode_token(jwt_token)
-            except (jwt.DecodeError, jwt.ExpiredSignatureError):
+            except jwt.InvalidTokenError:
                 return web.HTTPForbidden()
             try:
-                if check_cache(payload) is False:
+                if await check_cache(payload) is False:
                     return web.HTTPUnauthorized()
             except:
                 return web.HTTPUnauthorized()
             request.user = payload.get("name")
+            request.jwt_payload = payload
         return await handler(request)
 
     return middleware
@@ -78,24 +193,24 @@ def get_jti(length: int = 32):
     return generate_random(length)
 
 
-def get_token(username: str, jti: str):
+def get_token(username: str, jti: str, user_id: int = None):
     """
-    Create JWT token, including username + JTI
+    Create JWT token, including username + user_id + JTI
     :param username: username
     :param jti: JTI value (from get_jti(), for example)
+    :param user_id: user_id, saves user lookups on every message
     :return: JWT token
     """
     time_iat = datetime.utcnow()
     time_exp = timedelta(seconds=JWTConfiguration.JWT_EXP_DELTA_SECONDS)
     payload = {
         "name": username,
+        "uid": user_id,
         "jti": jti,
         "iat": time_iat,
         "exp": time_iat + time_exp,
     }
-    jwt_token = jwt.encode(
-        payload, JWTConfiguration.JWT_SECRET, JWTConfiguration.JWT_ALGORITHM
-    )
+    jwt_token = jwt.encode(payload, keys.signing_key(), keys.algorithm)
     return jwt_token.decode("utf-8")
 
 
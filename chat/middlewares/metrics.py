@@ -0,0 +1,27 @@
+from time import perf_counter
+
+from aiohttp.web import middleware
+
+from chat.utils.metrics import HTTP_LATENCY, WEBSOCKET_SESSION_DURATION
+
+
+@middleware
+async def metrics_middleware(request, handler):
+    """
+    Measure request duration per handler (route path, "unmatched" for 404),
+    WebSocket sessions last until the socket is closed, they are measured apart
+    :param request: request from user
+    :param handler: trigger handler (who call us?)
+    :return: original handler response
+    """
+    started = perf_counter()
+    try:
+        return await handler(request)
+    finally:
+        duration = perf_counter() - started
+        if request.headers.get("Upgrade", "").lower() == "websocket":
+            WEBSOCKET_SESSION_DURATION.observe(duration)
+        else:
+            resource = request.match_info.route.resource
+            name = resource.canonical if resource is not None else "unmatched"
+            HTTP_LATENCY.labels(name).observe(duration)
@@ -116,29 +116,94 @@ window.addEventListener('hashchange', function(event) {
             // Create WebSocket connection
             const ws = `ws://${window.location.hostname}:${window.location.port}/api/chat/ws`;
             const container = document.getElementById('chat-container');
-            const socket = new WebSocket(ws);
+            let socket = null;
+            // Sequence number of the last message of the default room, to resume after reconnect
+            let lastSeq = null;
+            // Inbox ids of the direct messages already shown
+            const seenDirect = new Set();
 
-            auth = JSON.stringify({'token': tokenStorage.getToken(), 'message': 'auth'})
-            socket.onopen = () => socket.send(auth);
-
-            socket.onmessage = function(event) {
+            const showMessage = function(jsonMessage) {
+                // Online users diff: who joined and who left since the last one
+                if (jsonMessage.type === 'presence') {
+                    jsonMessage.joined.forEach((user) => showNotice(`User ${user} joined the server`));
+                    jsonMessage.left.forEach((user) => showNotice(`User ${user} left the server`));
+                    return;
+                }
+                // Direct messages have no room: "sender -> recipient (time): text"
+                if (jsonMessage.type === 'direct') {
+                    // The same inbox message can be sent live and from the inbox on reconnect
+                    if (jsonMessage.id !== null && jsonMessage.id !== undefined) {
+                        if (seenDirect.has(jsonMessage.id)) {
+                            return;
+                        }
+                        seenDirect.add(jsonMessage.id);
+                    }
+                    showNotice(`${jsonMessage.user} -> ${jsonMessage.to} (${jsonMessage.time}): ${jsonMessage.message}`);
+                    return;
+                }
+                if (jsonMessage.room === 'general' && jsonMessage.seq !== null && jsonMessage.seq !== undefined) {
+                    lastSeq = jsonMessage.seq;
+                }
                 const element = document.createElement('div');
-                const jsonMessage = JSON.parse(event.data);
                 const textMessage = document.createTextNode(`${jsonMessage.user} (${jsonMessage.time}): ${jsonMessage.message}`);
                 element.appendChild(textMessage);
                 container.appendChild(element);
             };
-            socket.onclose = function(event) {
+            const showNotice = function(text) {
+                const element = document.createElement('div');
+                const textMessage = document.createTextNode(text);
+                element.appendChild(textMessage);
+                element.setAttribute('style', 'color:gray;');
+                container.appendChild(element);
+            };
+            const showClosed = function(text) {
                 const element = document.createElement('div');
-                const textMessage = document.createTextNode('Websocket closed. Please reload.');
+                const textMessage = document.createTextNode(text);
                 element.appendChild(textMessage);
                 element.setAttribute('style', 'color:red;');
                 container.appendChild(element);
             };
+            const connect = function() {
+                socket = new WebSocket(ws);
+
+                auth = JSON.stringify({'token': tokenStorage.getToken(), 'message': 'auth', 'last_seq': lastSeq})
+                socket.onopen = () => socket.send(auth);
+
+                socket.onmessage = function(event) {
+                    const jsonMessage = JSON.parse(event.data);
+                    // Slow clients can get several messages coalesced into one array
+                    if (Array.isArray(jsonMessage)) {
+                        jsonMessage.forEach(showMessage);
+                    } else {
+                        showMessage(jsonMessage);
+                    }
+                };
+                socket.onclose = function(event) {
+                    // 1012 - server restart, reconnect after the delay it asked for
+                    if (event.code === 1012) {
+                        let delay = 1000;
+                        try {
+                            delay = JSON.parse(event.reason).reconnect_after;
+                        } catch (error) {}
+                        showClosed(`Server is restarting, reconnect in ${Math.ceil(delay / 1000)} s.`);
+                        setTimeout(connect, delay);
+                        return;
+                    }
+                    showClosed('Websocket closed. Please reload.');
+                };
+            };
+            connect();
+
             enterListener('send-button', 'chat-container');
             document.getElementById('send-button').addEventListener('click', function() {
                 const messageFieldElem = document.getElementById('message-field');
-                const jsonMessage = JSON.stringify({
+                // "/msg <username> <text>" sends a direct message
+                const direct = messageFieldElem.value.match(/^\/msg\s+(\S+)\s+(.+)$/);
+                const jsonMessage = JSON.stringify(direct ? {
+                    'type': 'direct',
+                    'to': direct[1],
+                    'message': direct[2],
+                } : {
                     'message': messageFieldElem.value,
                 });
                 socket.send(jsonMessage);
@@ -0,0 +1,19 @@
+"""
+Fast JSON codec: orjson when available, stdlib json otherwise.
+dumps() always returns UTF-8 bytes, ready to be written to the wire.
+"""
+
+try:
+    from orjson import dumps, loads
+except ImportError:
+    from json import dumps as json_dumps, loads
+
+    def dumps(obj) -> bytes:
+        """
+        Serialize object to compact JSON
+        :param obj: object to serialize
+        :return: UTF-8 encoded JSON
+        """
+        return json_dumps(obj, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
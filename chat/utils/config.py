@@ -32,17 +32,33 @@ class DbValues:
     POSTGRES_PASSWORD = environ.get("POSTGRES_PASSWORD")
     POSTGRES_USER = environ.get("POSTGRES_USER")
 
+    # Connection pool
+    POOL_SIZE = int(environ.get("POSTGRES_POOL_SIZE", default="10"))
+    POOL_MAX_OVERFLOW = int(environ.get("POSTGRES_POOL_MAX_OVERFLOW", default="5"))
+    POOL_TIMEOUT = float(environ.get("POSTGRES_POOL_TIMEOUT", default="5"))
+    POOL_RECYCLE = int(environ.get("POSTGRES_POOL_RECYCLE", default="1800"))
+    POOL_PRE_PING = environ.get("POSTGRES_POOL_PRE_PING", default="1") == "1"
+
+    # Username -> user_id cache, usernames never change after registration
+    USER_ID_CACHE_SIZE = int(environ.get("USER_ID_CACHE_SIZE", default="10000"))
+
 
 class JWTConfiguration:
     """
     Define JWT configuration, take JWT secret from the env
     variable or generate the fallback.
-    Expiration = seconds * minutes, use it as you wish (15 minutes for now)
+    Asymmetric algorithms (RS256, ES256, EdDSA if PyJWT supports it) use
+    PEM key files instead, workers that only verify tokens need the public key.
+    Expiration = seconds * minutes, use it as you wish (15 minutes for now),
+    memo size - max verified tokens to remember until they expire
     """
 
     JWT_SECRET = environ.get("JWT_SECRET") or generate_random(length=32)
-    JWT_ALGORITHM = "HS256"
+    JWT_ALGORITHM = environ.get("JWT_ALGORITHM", default="HS256")
+    JWT_PRIVATE_KEY_FILE = environ.get("JWT_PRIVATE_KEY_FILE")
+    JWT_PUBLIC_KEY_FILE = environ.get("JWT_PUBLIC_KEY_FILE")
     JWT_EXP_DELTA_SECONDS = 60 * 15
+    JWT_MEMO_SIZE = int(environ.get("JWT_MEMO_SIZE", default="10000"))
 
 
 class CacheValues:
@@ -53,6 +69,269 @@ class CacheValues:
 
     REDIS_EXP = JWTConfiguration.JWT_EXP_DELTA_SECONDS
     REDIS_HOST = environ.get("REDIS_HOST", default="localhost")
+    REDIS_ADDRESS = f"redis://{REDIS_HOST}"
+    REDIS_POOL_MINSIZE = int(environ.get("REDIS_POOL_MINSIZE", default="1"))
+    REDIS_POOL_MAXSIZE = int(environ.get("REDIS_POOL_MAXSIZE", default="10"))
+
+
+class JTICacheValues:
+    """
+    Define in-process JTI cache values. TTL is capped
+    at the JWT expiration time, invalidations go through the Redis channel.
+    """
+
+    SIZE = int(environ.get("JTI_CACHE_SIZE", default="10000"))
+    TTL = min(
+        float(environ.get("JTI_CACHE_TTL", default="60")),
+        JWTConfiguration.JWT_EXP_DELTA_SECONDS,
+    )
+    CHANNEL = "chat:jti:invalidate"
+
+
+class PasswordHashingValues:
+    """
+    Define Argon2 password hashing values.
+    Cost parameters can be upgraded per deployment, old hashes
+    are rehashed on the next successful login.
+    Hashing runs in the "thread" or "process" executor with max workers,
+    max concurrent hashes (running or waiting in the executor) and
+    max seconds to wait for a free slot before answering 503
+    """
+
+    TIME_COST = int(environ.get("ARGON2_TIME_COST", default="2"))
+    MEMORY_COST = int(environ.get("ARGON2_MEMORY_COST", default="102400"))
+    PARALLELISM = int(environ.get("ARGON2_PARALLELISM", default="8"))
+    EXECUTOR = environ.get("HASHING_EXECUTOR", default="thread")
+    WORKERS = int(environ.get("HASHING_WORKERS", default="4"))
+    MAX_CONCURRENT = int(environ.get("HASHING_MAX_CONCURRENT", default="16"))
+    QUEUE_TIMEOUT = float(environ.get("HASHING_QUEUE_TIMEOUT", default="2.0"))
+
+
+class MessageValues:
+    """
+    Define chat message values.
+    Max length - longer messages (room and direct) are rejected
+    """
+
+    MAX_LENGTH = int(environ.get("MESSAGE_MAX_LENGTH", default="4096"))
+
+
+class MessageWriterValues:
+    """
+    Define background message writer values.
+    Batch size - max messages to save with one INSERT,
+    flush interval - max seconds to hold a non-empty batch,
+    queue size - max pending messages, senders will wait when it's full
+    """
+
+    BATCH_SIZE = int(environ.get("MESSAGE_BATCH_SIZE", default="100"))
+    FLUSH_INTERVAL = float(environ.get("MESSAGE_FLUSH_INTERVAL", default="0.5"))
+    QUEUE_SIZE = int(environ.get("MESSAGE_QUEUE_SIZE", default="10000"))
+
+
+class BroadcastValues:
+    """
+    Define broadcast backend values.
+    Backend - "memory" for a single process or "redis" to share
+    messages and recent history between several workers.
+    Max rooms - rooms whose history and sequence counter are kept in process
+    memory (least recently used are dropped), room TTL - seconds to keep
+    Redis history and counters of a room without messages
+    """
+
+    BACKEND = environ.get("BROADCAST_BACKEND", default="memory")
+    HISTORY_SIZE = int(environ.get("BROADCAST_HISTORY_SIZE", default="10"))
+    MAX_ROOMS = int(environ.get("BROADCAST_MAX_ROOMS", default="10000"))
+    ROOM_TTL = int(environ.get("BROADCAST_ROOM_TTL", default="604800"))
+    REDIS_CHANNEL = "chat:broadcast"
+    REDIS_HISTORY_KEY = "chat:history"
+    REDIS_SEQ_KEY = "chat:seq"
+
+
+class RoomValues:
+    """
+    Define chat rooms values.
+    Every client joins the default room on connect,
+    room names follow the same rules as usernames (plus "-" and "_")
+    """
+
+    DEFAULT_ROOM = "general"
+    NAME_REGEX = r"^[a-zA-Z0-9_-]{1,32}$"
+    MAX_ROOMS_PER_CLIENT = int(environ.get("MAX_ROOMS_PER_CLIENT", default="10"))
+
+
+class HistoryValues:
+    """
+    Define message history values.
+    Page size - default and max messages per one history API page,
+    backlog - messages to send on room join, source - where to take them:
+    "memory" (broadcast backend ring, backlog = BROADCAST_HISTORY_SIZE)
+    or "database", replay limit - max missed messages to send to a client
+    that resumes from its last sequence number, replay wait - max seconds
+    to wait for the missed messages to be saved before replaying them
+    """
+
+    PAGE_SIZE = int(environ.get("HISTORY_PAGE_SIZE", default="50"))
+    MAX_PAGE_SIZE = int(environ.get("HISTORY_MAX_PAGE_SIZE", default="100"))
+    BACKLOG = int(environ.get("HISTORY_BACKLOG", default="10"))
+    SOURCE = environ.get("HISTORY_SOURCE", default="memory")
+    REPLAY_LIMIT = int(environ.get("HISTORY_REPLAY_LIMIT", default="500"))
+    REPLAY_WAIT = float(environ.get("HISTORY_REPLAY_WAIT", default="2"))
+
+
+class DirectValues:
+    """
+    Define direct messages values.
+    Messages to offline users wait in the inbox table until their next
+    connection, inbox batch - max messages to take out of it with one query
+    """
+
+    INBOX_BATCH = int(environ.get("DIRECT_INBOX_BATCH", default="100"))
+
+
+class ClientQueueValues:
+    """
+    Define per-client outbound queue values.
+    Queue size - max pending messages per connection,
+    overflow policy - what to do with a slow client when its queue is full:
+    "drop_oldest", "coalesce" (merge pending messages into one frame)
+    or "disconnect"
+    """
+
+    QUEUE_SIZE = int(environ.get("CLIENT_QUEUE_SIZE", default="256"))
+    OVERFLOW_POLICY = environ.get("CLIENT_OVERFLOW_POLICY", default="drop_oldest")
+
+
+class RegistryValues:
+    """
+    Define WebSocket connection registry values.
+    Shards - number of groups to split all connections of a worker into,
+    so bulk operations (reaping, shutdown) yield to the event loop between them
+    """
+
+    SHARDS = int(environ.get("WS_REGISTRY_SHARDS", default="16"))
+
+
+class PresenceValues:
+    """
+    Define presence values.
+    Interval - seconds to collect joins and leaves into one diff,
+    TTL - seconds to keep online users of a worker that stopped
+    updating them in Redis (crashed), then they are announced as left.
+    Shared presence needs a single Redis node, not Redis Cluster
+    """
+
+    INTERVAL = float(environ.get("PRESENCE_INTERVAL", default="0.5"))
+    TTL = float(environ.get("PRESENCE_TTL", default="10"))
+    REDIS_KEY = "chat:presence"
+
+
+class RateLimitValues:
+    """
+    Define token bucket rate limits: rate - tokens per second (0 - no limit),
+    burst - bucket size. Messages are limited per user, login and register
+    per client IP. Buckets are in-process, or shared in Redis when
+    the Redis broadcast backend is used (several workers), local size -
+    max in-process buckets to keep. Trusted proxies - comma separated
+    addresses or networks of reverse proxies, the client IP is taken from
+    their X-Forwarded-For/Forwarded headers (empty - headers are ignored)
+    """
+
+    MESSAGE_RATE = float(environ.get("RATE_LIMIT_MESSAGE_RATE", default="5"))
+    MESSAGE_BURST = int(environ.get("RATE_LIMIT_MESSAGE_BURST", default="20"))
+    LOGIN_RATE = float(environ.get("RATE_LIMIT_LOGIN_RATE", default="0.2"))
+    LOGIN_BURST = int(environ.get("RATE_LIMIT_LOGIN_BURST", default="10"))
+    REGISTER_RATE = float(environ.get("RATE_LIMIT_REGISTER_RATE", default="0.05"))
+    REGISTER_BURST = int(environ.get("RATE_LIMIT_REGISTER_BURST", default="5"))
+    LOCAL_SIZE = int(environ.get("RATE_LIMIT_LOCAL_SIZE", default="100000"))
+    TRUSTED_PROXIES = [
+        proxy.strip()
+        for proxy in environ.get("TRUSTED_PROXIES", default="").split(",")
+        if proxy.strip()
+    ]
+    REDIS_KEY = "chat:ratelimit"
+
+
+class HeartbeatValues:
+    """
+    Define WebSocket liveness values (seconds, 0 - disabled).
+    Heartbeat - ping interval, a client that doesn't answer with pong in half
+    of it is disconnected, handshake timeout - max wait for the auth message,
+    idle timeout - max time without messages from the client,
+    reaper interval - how often to look for dead and idle connections
+    """
+
+    HEARTBEAT = float(environ.get("WS_HEARTBEAT", default="30"))
+    HANDSHAKE_TIMEOUT = float(environ.get("WS_HANDSHAKE_TIMEOUT", default="10"))
+    IDLE_TIMEOUT = float(environ.get("WS_IDLE_TIMEOUT", default="0"))
+    REAPER_INTERVAL = float(environ.get("WS_REAPER_INTERVAL", default="30"))
+
+
+class CompressionValues:
+    """
+    Define WebSocket permessage-deflate values (opt-in).
+    Level - zlib compression level, threshold - smaller payloads are sent
+    uncompressed, shared - force "server_no_context_takeover" so every
+    broadcast message is compressed once and reused for all clients
+    """
+
+    ENABLED = environ.get("WS_COMPRESSION", default="0") == "1"
+    LEVEL = int(environ.get("WS_COMPRESSION_LEVEL", default="6"))
+    THRESHOLD = int(environ.get("WS_COMPRESSION_THRESHOLD", default="128"))
+    SHARED = environ.get("WS_COMPRESSION_SHARED", default="1") == "1"
+
+
+class WatchdogValues:
+    """
+    Define event loop watchdog values.
+    Interval - seconds between loop heartbeats, threshold - lag in seconds
+    to treat as a stall, sample interval - seconds between stack samples
+    of the stalled loop
+    """
+
+    ENABLED = environ.get("LOOP_WATCHDOG", default="1") == "1"
+    INTERVAL = float(environ.get("LOOP_WATCHDOG_INTERVAL", default="0.1"))
+    THRESHOLD = float(environ.get("LOOP_WATCHDOG_THRESHOLD", default="0.1"))
+    SAMPLE_INTERVAL = float(environ.get("LOOP_WATCHDOG_SAMPLE", default="0.01"))
+
+
+class WorkerValues:
+    """
+    Define multi-worker mode values.
+    Workers - number of worker processes sharing the port (1 - no supervisor),
+    shutdown timeout - seconds to wait for a worker to stop before killing it,
+    restart delay - pause before restarting a worker that crashed on start
+    """
+
+    WORKERS = int(environ.get("WORKERS", default="1"))
+    SHUTDOWN_TIMEOUT = float(environ.get("WORKER_SHUTDOWN_TIMEOUT", default="30"))
+    RESTART_DELAY = float(environ.get("WORKER_RESTART_DELAY", default="1"))
+
+
+class DrainValues:
+    """
+    Define graceful shutdown values.
+    Deadline - max seconds to flush client queues and pending message writes,
+    clients are asked to reconnect after min delay plus random jitter (ms),
+    so they don't all come back at the same moment
+    """
+
+    DEADLINE = float(environ.get("SHUTDOWN_DEADLINE", default="10"))
+    RECONNECT_MIN_MS = int(environ.get("RECONNECT_MIN_MS", default="1000"))
+    RECONNECT_JITTER_MS = int(environ.get("RECONNECT_JITTER_MS", default="10000"))
+
+
+class StaticValues:
+    """
+    Define in-memory static assets values.
+    Reload - check files on every request and reload changed ones (development),
+    max age - cache lifetime of versioned scripts ("?v=<version>" URLs),
+    min compress size - smaller files are not compressed
+    """
+
+    RELOAD = environ.get("STATIC_RELOAD", default="0") == "1"
+    MAX_AGE = int(environ.get("STATIC_MAX_AGE", default=str(365 * 24 * 60 * 60)))
+    MIN_COMPRESS_SIZE = int(environ.get("STATIC_MIN_COMPRESS_SIZE", default="256"))
 
 
 class CSRFCongiruation:
@@ -72,3 +351,5 @@ class ServiceConfiguration:
     ORIGIN = (
         [environ.get("ORIGIN")] if environ.get("ORIGIN") else ["0.0.0.0", "localhost"]
     )
+    HOST = environ.get("HOST", default="0.0.0.0")
+    PORT = int(environ.get("PORT", default="8080"))
@@ -0,0 +1,300 @@
+"""
+Minimal Prometheus-style metrics.
+All metrics and their labeled children are created once and updated in place,
+so instrumentation of the hot paths allocates nothing per call.
+"""
+
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+# Latency buckets in seconds, from 0.5 ms to 10 s
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Registry:
+    """
+    Keep metrics and render them in Prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric) -> None:
+        """
+        Add metric to the registry
+        :param metric: metric
+        :return: None
+        """
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        """
+        Render all metrics
+        :return: Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            metric.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def label_string(names: tuple, values: tuple, extra: str = "") -> str:
+    """
+    Render labels
+    :param names: label names
+    :param values: label values
+    :param extra: additional rendered label (for example le="0.1")
+    :return: {name="value",...} or empty string
+    """
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Metric:
+    """
+    Base metric with optional labels, children are created once per label values
+    """
+
+    kind = "untyped"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple = (), registry=REGISTRY, **kwargs
+    ):
+        """
+        Init metric and register it
+        :param name: metric name
+        :param help: metric description
+        :param labels: label names
+        :param registry: registry to use
+        :param kwargs: options for children
+        """
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.options = kwargs
+        self.children = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """
+        Get child metric for the label values, create it on first use
+        :param values: label values
+        :return: child metric
+        """
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = type(self)(
+                self.name, self.help, registry=None, **self.options
+            )
+        return child
+
+    def render(self, lines: list) -> None:
+        if self.label_names:
+            # Children may be added from the watchdog thread
+            for values, child in list(self.children.items()):
+                child.render_samples(lines, self.label_names, values)
+        else:
+            self.render_samples(lines, (), ())
+
+    def render_samples(self, lines: list, names: tuple, values: tuple) -> None:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    Monotonic counter, or a function returning the current total
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, function=None, **kwargs):
+        super().__init__(name, help, **kwargs)
+        self.value = 0
+        self.function = function
+
+    def inc(self, value: float = 1) -> None:
+        self.value += value
+
+    def set_function(self, function) -> None:
+        self.function = function
+
+    def render_samples(self, lines: list, names: tuple, values: tuple) -> None:
+        value = self.function() if self.function else self.value
+        lines.append(f"{self.name}{label_string(names, values)} {value}")
+
+
+class Gauge(Metric):
+    """
+    Value that goes up and down, or a function returning the current value
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, function=None, **kwargs):
+        super().__init__(name, help, **kwargs)
+        self.value = 0
+        self.function = function
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function) -> None:
+        self.function = function
+
+    def render_samples(self, lines: list, names: tuple, values: tuple) -> None:
+        value = self.function() if self.function else self.value
+        lines.append(f"{self.name}{label_string(names, values)} {value}")
+
+
+class Histogram(Metric):
+    """
+    Histogram with fixed buckets
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS, **kwargs
+    ):
+        super().__init__(name, help, buckets=buckets, **kwargs)
+        self.buckets = buckets
+        # The last slot is for values above the largest bucket (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render_samples(self, lines: list, names: tuple, values: tuple) -> None:
+        labels = label_string(names, values)
+        cumulative = 0
+        for bucket, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            bucket_labels = label_string(names, values, f'le="{bucket}"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{labels} {self.sum}")
+        lines.append(f"{self.name}_count{labels} {self.count}")
+
+
+def timed(histogram: Histogram):
+    """
+    Observe duration of every call of the coroutine function
+    :param histogram: histogram (or its labeled child) to use
+    :return: decorator
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+# Application metrics
+WEBSOCKET_CONNECTIONS = Gauge(
+    "chat_websocket_connections", "Connected WebSocket clients of this worker"
+)
+MESSAGES = Counter("chat_messages_total", "Chat messages sent by users")
+BROADCAST_FANOUT = Histogram(
+    "chat_broadcast_fanout_seconds",
+    "Time to hand one broadcast message to all local clients",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1),
+)
+HTTP_LATENCY = Histogram(
+    "chat_http_request_duration_seconds",
+    "HTTP request duration per handler",
+    labels=("handler",),
+)
+WEBSOCKET_SESSION_DURATION = Histogram(
+    "chat_websocket_session_duration_seconds",
+    "WebSocket session duration, from the upgrade request to close",
+    buckets=(1.0, 10.0, 60.0, 300.0, 900.0, 3600.0, 14400.0, 86400.0),
+)
+REDIS_LATENCY = Histogram(
+    "chat_redis_call_duration_seconds", "Redis call duration", labels=("command",)
+)
+DB_LATENCY = Histogram(
+    "chat_db_call_duration_seconds", "Database call duration", labels=("operation",)
+)
+LOOP_LAG = Gauge("chat_event_loop_lag_seconds", "Last measured event loop lag")
+LOOP_STALLS = Counter(
+    "chat_event_loop_stalls_total",
+    "Event loop stalls by blocking handler",
+    labels=("handler",),
+)
+LOOP_STALL_DURATION = Histogram(
+    "chat_event_loop_stall_seconds",
+    "Event loop stall duration",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+DB_POOL_WAIT = Histogram(
+    "chat_db_pool_wait_seconds", "Time to check out a pooled database connection"
+)
+DB_POOL_CHECKED_OUT = Gauge("chat_db_pool_checked_out", "Database connections in use")
+DB_POOL_UTILISATION = Gauge(
+    "chat_db_pool_utilisation", "Share of the database pool capacity in use"
+)
+WRITER_QUEUE_DEPTH = Gauge(
+    "chat_writer_queue_depth", "Chat messages waiting to be saved"
+)
+CLIENT_QUEUE_DEPTH = Gauge(
+    "chat_client_queue_depth", "Outbound frames queued for all clients"
+)
+CLIENT_QUEUE_MAX_DEPTH = Gauge(
+    "chat_client_queue_max_depth", "Outbound frames queued for the slowest client"
+)
+CLIENT_FRAMES_DROPPED = Counter(
+    "chat_client_frames_dropped_total", "Outbound frames dropped for slow clients"
+)
+CLIENT_FRAMES_COALESCED = Counter(
+    "chat_client_frames_coalesced_total", "Outbound frames merged for slow clients"
+)
+CONNECTIONS_REAPED = Counter(
+    "chat_websocket_reaped_total",
+    "WebSocket connections closed by the server: handshake, heartbeat, idle, dead",
+    labels=("reason",),
+)
+RATE_LIMITED = Counter(
+    "chat_rate_limited_total", "Requests rejected by rate limits", labels=("limit",)
+)
+CLIENT_SLOW_DISCONNECTS = Counter(
+    "chat_client_slow_disconnects_total", "Clients disconnected as slow consumers"
+)
+JTI_CACHE_HITS = Counter("chat_jti_cache_hits_total", "JTI local cache hits")
+JTI_CACHE_MISSES = Counter("chat_jti_cache_misses_total", "JTI local cache misses")
+JWT_MEMO_HITS = Counter("chat_jwt_memo_hits_total", "Verified JWT memo hits")
+JWT_MEMO_MISSES = Counter("chat_jwt_memo_misses_total", "Verified JWT memo misses")
@@ -0,0 +1,113 @@
+from asyncio import Semaphore, TimeoutError, get_event_loop, wait_for
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHash
+
+from chat.utils.config import PasswordHashingValues
+
+# Use argon2 password hasher, created on import in every process pool worker too
+ph = PasswordHasher(
+    time_cost=PasswordHashingValues.TIME_COST,
+    memory_cost=PasswordHashingValues.MEMORY_COST,
+    parallelism=PasswordHashingValues.PARALLELISM,
+)
+
+
+class HashingUnavailable(Exception):
+    """
+    Raised when there is no free hashing slot in time
+    """
+
+
+def _hash(password: str) -> str:
+    return ph.hash(password)
+
+
+def _verify(password_hash: str, password: str) -> bool:
+    try:
+        return ph.verify(hash=password_hash, password=password)
+    except (VerificationError, InvalidHash):
+        return False
+
+
+class PasswordHashing:
+    """
+    Run Argon2 hashing and verification in the executor pool,
+    so logins don't freeze the event loop
+    """
+
+    def __init__(
+        self,
+        executor: str = PasswordHashingValues.EXECUTOR,
+        workers: int = PasswordHashingValues.WORKERS,
+        max_concurrent: int = PasswordHashingValues.MAX_CONCURRENT,
+        timeout: float = PasswordHashingValues.QUEUE_TIMEOUT,
+    ):
+        """
+        Init hashing pool
+        :param executor: "thread" (argon2-cffi releases the GIL) or "process"
+        :param workers: max workers in the pool
+        :param max_concurrent: max hashes running or waiting in the pool
+        :param timeout: max seconds to wait for a free slot
+        """
+        executors = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+        self.executor = executors[executor](max_workers=workers)
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._slots = None
+
+    async def close(self, app=None) -> None:
+        """
+        Shutdown executor pool (on_cleanup signal)
+        :param app: web app
+        :return: None
+        """
+        self.executor.shutdown(wait=True)
+
+    async def _run(self, func, *args):
+        """
+        Run function in the pool if there is a free slot in time
+        :param func: function to run
+        :param args: function args
+        :return: function result
+        """
+        if self._slots is None:
+            self._slots = Semaphore(self.max_concurrent)
+        try:
+            await wait_for(self._slots.acquire(), timeout=self.timeout)
+        except TimeoutError:
+            raise HashingUnavailable("Password hashing is busy")
+        try:
+            return await get_event_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        """
+        Hash password
+        :param password: password
+        :return: Argon2 hash
+        """
+        return await self._run(_hash, password)
+
+    async def verify(self, password_hash: str, password: str) -> bool:
+        """
+        Verify password against hash
+        :param password_hash: Argon2 hash
+        :param password: password
+        :return: True if correct, else False
+        """
+        return await self._run(_verify, password_hash, password)
+
+    @staticmethod
+    def needs_rehash(password_hash: str) -> bool:
+        """
+        Check that hash was created with the current parameters
+        :param password_hash: Argon2 hash
+        :return: True if outdated
+        """
+        return ph.check_needs_rehash(password_hash)
+
+
+passwords = PasswordHashing()
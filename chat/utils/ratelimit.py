@@ -0,0 +1,189 @@
+import logging
+from collections import OrderedDict
+from ipaddress import ip_address, ip_network
+from time import monotonic, time
+
+from chat.utils.config import RateLimitValues
+from chat.utils.metrics import RATE_LIMITED
+
+log = logging.getLogger(__name__)
+
+TRUSTED_PROXIES = [
+    ip_network(proxy, strict=False) for proxy in RateLimitValues.TRUSTED_PROXIES
+]
+
+# Token bucket in a Redis hash, refilled and charged atomically
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call("HMSET", KEYS[1], "tokens", tokens, "updated", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return allowed
+"""
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter: every key gets "burst" tokens refilled
+    at "rate" tokens per second, every request takes one token.
+    Buckets are kept in-process (LRU-limited), or in Redis if the cache
+    is set, so all workers share them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        cache=None,
+        size: int = RateLimitValues.LOCAL_SIZE,
+        prefix: str = RateLimitValues.REDIS_KEY,
+    ):
+        """
+        Init limiter
+        :param name: limit name (metrics label and Redis key part)
+        :param rate: tokens per second, 0 - no limit
+        :param burst: bucket size
+        :param cache: RedisCache to share buckets, None - in-process buckets
+        :param size: max in-process buckets
+        :param prefix: Redis key prefix
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.cache = cache
+        self.size = size
+        self.prefix = f"{prefix}:{name}"
+        self._buckets = OrderedDict()
+        self._rejected = RATE_LIMITED.labels(name)
+        self._shared_down = False
+
+    async def allow(self, key: str) -> bool:
+        """
+        Take one token from the bucket of the key
+        :param key: username, IP, etc.
+        :return: True if allowed, False if the limit is exceeded
+        """
+        if not self.rate:
+            return True
+        if self.cache is not None:
+            try:
+                allowed = await self.cache.eval(
+                    TOKEN_BUCKET_SCRIPT,
+                    keys=[f"{self.prefix}:{key}"],
+                    args=[self.rate, self.burst, time()],
+                )
+            except Exception as error:
+                # Redis is unavailable, limit this worker alone until it is back
+                if not self._shared_down:
+                    self._shared_down = True
+                    log.warning(f"Shared {self.name} rate limit failed: {error!r}")
+                allowed = self._allow_local(key)
+            else:
+                if self._shared_down:
+                    self._shared_down = False
+                    log.info(f"Shared {self.name} rate limit restored")
+        else:
+            allowed = self._allow_local(key)
+        if not allowed:
+            self._rejected.inc()
+        return bool(allowed)
+
+    def _allow_local(self, key: str) -> bool:
+        now = monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.size:
+                # Evicted bucket would be full again soon anyway
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+
+def _trusted(address: str) -> bool:
+    try:
+        address = ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def _forwarded_for(request) -> list:
+    """
+    Addresses from the proxy headers, the client first
+    :param request: web request
+    :return: list of addresses
+    """
+    forwarded = request.headers.get("Forwarded")
+    if forwarded:
+        addresses = []
+        for element in forwarded.split(","):
+            for pair in element.split(";"):
+                name, _, value = pair.strip().partition("=")
+                if name.lower() == "for":
+                    value = value.strip('"')
+                    # [IPv6]:port, IPv4:port
+                    if value.startswith("["):
+                        value = value[1:].partition("]")[0]
+                    elif value.count(":") == 1:
+                        value = value.partition(":")[0]
+                    addresses.append(value)
+        return addresses
+    forwarded = request.headers.get("X-Forwarded-For", "")
+    return [address.strip() for address in forwarded.split(",") if address.strip()]
+
+
+def client_address(request) -> str:
+    """
+    Client IP to limit login/register by. Behind trusted proxies it is taken
+    from their headers: the last address not added by a trusted proxy,
+    so a client can't choose it by sending the header itself
+    :param request: web request
+    :return: IP address
+    """
+    address = request.remote
+    if not TRUSTED_PROXIES or not _trusted(address):
+        return address
+    for forwarded in reversed(_forwarded_for(request)):
+        address = forwarded
+        if not _trusted(address):
+            break
+    return address
+
+
+message_limiter = RateLimiter(
+    "message", RateLimitValues.MESSAGE_RATE, RateLimitValues.MESSAGE_BURST
+)
+login_limiter = RateLimiter(
+    "login", RateLimitValues.LOGIN_RATE, RateLimitValues.LOGIN_BURST
+)
+register_limiter = RateLimiter(
+    "register", RateLimitValues.REGISTER_RATE, RateLimitValues.REGISTER_BURST
+)
+
+
+def share_limits(cache) -> None:
+    """
+    Keep all buckets in Redis, for several workers
+    :param cache: RedisCache
+    :return: None
+    """
+    for limiter in (message_limiter, login_limiter, register_limiter):
+        limiter.cache = cache
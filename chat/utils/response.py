@@ -47,6 +47,36 @@ class Responses:
             message = "Password: 8-30 chars, Username: 1-10 chars, (a-z, A-Z, 0-9)"
         return Responses.response(status, message, http_status)
 
+    @staticmethod
+    def too_many(
+        message: str = "Too many requests, try again later",
+        status: str = "error",
+        http_status: int = 429,
+    ):
+        """
+        Define rate limited JSON response
+        :param message: message explanation
+        :param status: status explanation
+        :param http_status: HTTP status of response
+        :return: web.json_response
+        """
+        return Responses.response(status, message, http_status)
+
+    @staticmethod
+    def busy(
+        message: str = "Server is busy, try again later",
+        status: str = "error",
+        http_status: int = 503,
+    ):
+        """
+        Define service unavailable JSON response
+        :param message: message explanation
+        :param status: status explanation
+        :param http_status: HTTP status of response
+        :return: web.json_response
+        """
+        return Responses.response(status, message, http_status)
+
     @staticmethod
     def success(
         message: str = "success", status: str = "success", http_status: int = 200
@@ -1,14 +1,241 @@
-from chat.utils.config import DefaultPaths
-from aiohttp.web import FileResponse
+import gzip
+from hashlib import sha1
+from pathlib import Path
+
+from aiohttp.web import Response
+
+from chat.utils.config import DefaultPaths, StaticValues
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CONTENT_TYPES = {".html": "text/html", ".js": "application/javascript"}
+
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """
+    Parse Accept-Encoding header
+    :param accept_encoding: header value, e.g. "gzip, br;q=0.8, *;q=0"
+    :return: dict encoding -> q-value (lowercase names, "*" included)
+    """
+    encodings = {}
+    for item in accept_encoding.split(","):
+        name, *params = item.split(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        encodings[name] = q
+    return encodings
+
+
+class Asset:
+    """
+    File loaded into memory with precompressed variants and a strong ETag
+    """
+
+    def __init__(self, path: Path, body: bytes):
+        """
+        Init asset, compress it with every supported encoding
+        :param path: file path
+        :param body: file content
+        """
+        self.path = path
+        self.mtime = path.stat().st_mtime
+        self.content_type = CONTENT_TYPES.get(path.suffix, "application/octet-stream")
+        self.version = sha1(body).hexdigest()[:16]
+        self.variants = {"identity": body}
+        if len(body) >= StaticValues.MIN_COMPRESS_SIZE:
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body)
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9)
+
+    def encoding(self, accept_encoding: str) -> str:
+        """
+        Choose the variant the client prefers (highest q-value),
+        the smallest one of equally preferred, q=0 means "not acceptable"
+        :param accept_encoding: Accept-Encoding header
+        :return: encoding name
+        """
+        accepted = accepted_encodings(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+        best, best_q = "identity", 0.0
+        for encoding in ("br", "gzip"):
+            q = accepted.get(encoding, wildcard)
+            if encoding in self.variants and q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.version}-{encoding}"'
+
+
+class Assets:
+    """
+    Keep templates and scripts in memory, serve them with 304 on matching ETag.
+    Script links in templates get "?v=<version>", so scripts can be cached
+    forever and are refetched only when they change.
+    """
+
+    def __init__(
+        self,
+        templates: Path = DefaultPaths.STATIC_TEMPLATES,
+        scripts: Path = DefaultPaths.STATIC_JS,
+        reload: bool = StaticValues.RELOAD,
+    ):
+        """
+        Init assets
+        :param templates: templates directory
+        :param scripts: scripts directory
+        :param reload: reload changed files (development)
+        """
+        self.templates_path = templates
+        self.scripts_path = scripts
+        self.reload = reload
+        self.templates = {}
+        self.scripts = {}
+        self._splits = {}
+
+    async def load(self, app=None) -> None:
+        """
+        Load all files (on_startup signal)
+        :param app: web app
+        :return: None
+        """
+        self.scripts = {
+            path.name: Asset(path, path.read_bytes())
+            for path in self.scripts_path.glob("*.js")
+        }
+        self.templates = {
+            path.name: self._load_template(path)
+            for path in self.templates_path.glob("*.html")
+        }
+        self._splits = {}
+
+    def _load_template(self, path: Path) -> Asset:
+        body = path.read_text(encoding="utf-8")
+        for name, script in self.scripts.items():
+            url = f"/static/js/{name}"
+            body = body.replace(f'"{url}"', f'"{url}?v={script.version}"')
+        return Asset(path, body.encode("utf-8"))
+
+    def _stale(self) -> bool:
+        """
+        Check if assets were never loaded or some file has changed (reload mode)
+        :return: True if assets should be loaded
+        """
+        if not self.templates:
+            return True
+        if not self.reload:
+            return False
+        assets = list(self.templates.values()) + list(self.scripts.values())
+        return any(asset.path.stat().st_mtime != asset.mtime for asset in assets)
+
+    async def template(self, name: str) -> Asset:
+        """
+        Get template
+        :param name: template file name
+        :return: asset
+        """
+        if self._stale():
+            await self.load()
+        return self.templates[name]
+
+    async def script(self, name: str) -> Asset or None:
+        """
+        Get script
+        :param name: script file name
+        :return: asset or None if there is no such script
+        """
+        if self._stale():
+            await self.load()
+        return self.scripts.get(name)
+
+    async def split(self, name: str, placeholder: str, **values) -> tuple:
+        """
+        Format template with constant values once and split it around
+        the per-request placeholder, so rendering is a concatenation
+        :param name: template file name
+        :param placeholder: name of the per-request value
+        :param values: constant values
+        :return: (head, tail)
+        """
+        asset = await self.template(name)
+        parts = self._splits.get(name)
+        if parts is None:
+            body = asset.variants["identity"].decode("utf-8")
+            marker = "\0"
+            body = body.format(**values, **{placeholder: marker})
+            parts = self._splits[name] = tuple(body.split(marker, 1))
+        return parts
+
+
+assets = Assets()
 
 
 class Serve:
     @staticmethod
-    def serve_static(template: str, path=DefaultPaths.STATIC_TEMPLATES):
+    def respond(request, asset: Asset, cache_control: str = "no-cache") -> Response:
         """
-        Serve static files easily
+        Serve asset from memory: 304 if the client has it, else the best variant
+        :param request: request from user
+        :param asset: asset
+        :param cache_control: Cache-Control header
+        :return: response
+        """
+        encoding = asset.encoding(request.headers.get("Accept-Encoding", ""))
+        headers = {
+            "ETag": asset.etag(encoding),
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        # Exact tag of the selected representation only (weak comparison)
+        if_none_match = [
+            tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()
+            for tag in request.headers.get("If-None-Match", "").split(",")
+        ]
+        if headers["ETag"] in if_none_match or "*" in if_none_match:
+            return Response(status=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(
+            body=asset.variants[encoding],
+            content_type=asset.content_type,
+            charset="utf-8",
+            headers=headers,
+        )
+
+    @staticmethod
+    async def serve_static(template: str, request):
+        """
+        Serve static template from memory
         :param template: template file name
-        :param path: path to directory
-        :return: file response
+        :param request: request from user
+        :return: response
+        """
+        return Serve.respond(request, await assets.template(template))
+
+    @staticmethod
+    async def script(request):
+        """
+        Serve script from memory, versioned URLs are cached forever
+        :param request: GET request from user
+        :return: response
         """
-        return FileResponse(path=path / template)
+        asset = await assets.script(request.match_info["name"])
+        if asset is None:
+            return Response(status=404)
+        if request.query.get("v") == asset.version:
+            cache_control = f"public, max-age={StaticValues.MAX_AGE}, immutable"
+        else:
+            cache_control = "no-cache"
+        return Serve.respond(request, asset, cache_control)
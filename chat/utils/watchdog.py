@@ -0,0 +1,168 @@
+import sys
+import threading
+from asyncio import CancelledError, get_event_loop, sleep
+from collections import Counter
+from inspect import unwrap
+from os.path import abspath, dirname
+from time import monotonic
+from traceback import format_stack
+
+from chat.utils.config import WatchdogValues
+from chat.utils.metrics import LOOP_LAG, LOOP_STALL_DURATION, LOOP_STALLS
+
+# Frames from these files are application code (handler names are taken from them)
+PACKAGE_PATH = dirname(dirname(abspath(__file__)))
+WATCHDOG_PATH = abspath(__file__)
+
+
+def frame_name(frame) -> str:
+    """
+    Get readable name of the function running in the frame,
+    e.g. "DatabaseCrud.save_messages" or "check_cache"
+    :param frame: frame
+    :return: qualified function name
+    """
+    code = frame.f_code
+    qualname = getattr(code, "co_qualname", None)
+    if qualname:
+        return qualname
+    # Python < 3.11, look the function up in the classes of its module
+    for value in list(frame.f_globals.values()):
+        if isinstance(value, type):
+            for attribute in vars(value).values():
+                function = unwrap(getattr(attribute, "__func__", attribute))
+                if getattr(function, "__code__", None) is code:
+                    return f"{value.__name__}.{code.co_name}"
+    return code.co_name
+
+
+class LoopWatchdog:
+    """
+    Detect event loop stalls caused by blocking code.
+    A heartbeat task measures loop lag, a separate thread notices a missed
+    heartbeat, samples the stack of the loop thread while it is blocked
+    and logs the most frequent blocking code path once the loop resumes.
+    """
+
+    def __init__(
+        self,
+        log,
+        interval: float = WatchdogValues.INTERVAL,
+        threshold: float = WatchdogValues.THRESHOLD,
+        sample_interval: float = WatchdogValues.SAMPLE_INTERVAL,
+    ):
+        """
+        Init watchdog
+        :param log: logger to use
+        :param interval: seconds between heartbeats
+        :param threshold: lag in seconds to treat as a stall
+        :param sample_interval: seconds between stack samples
+        """
+        self.log = log
+        self.interval = interval
+        self.threshold = threshold
+        self.sample_interval = sample_interval
+        self._beat = 0.0
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    async def start(self, app=None) -> None:
+        """
+        Start heartbeat task and watchdog thread (on_startup signal)
+        :param app: web app
+        :return: None
+        """
+        self._loop_thread = threading.get_ident()
+        self._beat = monotonic()
+        self._stopped.clear()
+        self._task = get_event_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    async def stop(self, app=None) -> None:
+        """
+        Stop heartbeat task and watchdog thread (on_cleanup signal)
+        :param app: web app
+        :return: None
+        """
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=self.sample_interval * 2)
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        loop = get_event_loop()
+        while True:
+            started = loop.time()
+            await sleep(self.interval)
+            LOOP_LAG.set(max(0.0, loop.time() - started - self.interval))
+            self._beat = monotonic()
+
+    def _watch(self) -> None:
+        """
+        Watchdog thread: sample the loop thread while heartbeats are late
+        :return: None
+        """
+        # Expected time of the missed heartbeat, None if the loop is running
+        stall = None
+        samples = Counter()
+        while not self._stopped.wait(self.sample_interval):
+            beat = self._beat
+            if stall is not None and beat + self.interval > stall:
+                self._report(beat - stall, samples)
+                stall = None
+                samples.clear()
+            if stall is None and monotonic() - beat - self.interval > self.threshold:
+                stall = beat + self.interval
+            if stall is not None:
+                sample = self._sample()
+                if sample is not None:
+                    samples[sample] += 1
+
+    def _sample(self) -> tuple or None:
+        """
+        Capture the current stack of the loop thread
+        :return: (handler name, formatted stack) or None
+        """
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return None
+        # Innermost application frame is the blocking handler
+        handler = "unknown"
+        current = frame
+        while current is not None:
+            filename = current.f_code.co_filename
+            if filename.startswith(PACKAGE_PATH) and filename != WATCHDOG_PATH:
+                handler = frame_name(current)
+                break
+            current = current.f_back
+        return handler, "".join(format_stack(frame))
+
+    def _report(self, duration: float, samples: Counter) -> None:
+        """
+        Log the stall and update metrics
+        :param duration: stall duration in seconds
+        :param samples: stack samples taken during the stall
+        :return: None
+        """
+        LOOP_STALL_DURATION.observe(duration)
+        if not samples:
+            LOOP_STALLS.labels("unknown").inc()
+            return
+        (handler, stack), count = samples.most_common(1)[0]
+        LOOP_STALLS.labels(handler).inc()
+        self.log.warning(
+            f"Event loop blocked for {duration * 1000:.0f} ms in {handler} "
+            f"({count} of {sum(samples.values())} samples):\n{stack}"
+        )
@@ -0,0 +1,329 @@
+from asyncio import CancelledError, get_event_loop, sleep
+from collections import OrderedDict, deque
+
+import aioredis
+
+from chat.cache.local import LocalCache
+from chat.utils.config import BroadcastValues, CacheValues
+
+
+class BroadcastBackend:
+    """
+    Base broadcast backend.
+    Publish a message to the room once, every subscribed worker gets it
+    and delivers it to its own clients in this room.
+    Messages are UTF-8 encoded JSON bytes, encoded once by the sender.
+    Every room has its own sequence of message numbers, counters continue
+    from the last saved number (last_seq) after restart.
+    """
+
+    def __init__(
+        self, log, history_size: int = BroadcastValues.HISTORY_SIZE, last_seq=None
+    ):
+        """
+        Init backend
+        :param log: logger to use
+        :param history_size: how many recent messages to keep per room
+        :param last_seq: coroutine function (room) -> last saved sequence number
+        """
+        self.log = log
+        self.history_size = history_size
+        self.last_seq = last_seq
+        self._handlers = []
+
+    async def _initial_seq(self, room: str) -> int:
+        """
+        Get the number to continue the room sequence from
+        :param room: room name
+        :return: sequence number
+        """
+        if self.last_seq is None:
+            return 0
+        return await self.last_seq(room)
+
+    def subscribe(self, handler) -> None:
+        """
+        Register handler to call for every published message
+        :param handler: callable with two arguments (room, message)
+        :return: None
+        """
+        self._handlers.append(handler)
+
+    def _deliver(self, room: str, message: bytes) -> None:
+        """
+        Pass message to the local handlers
+        :param room: room name
+        :param message: message
+        :return: None
+        """
+        for handler in self._handlers:
+            handler(room, message)
+
+    async def start(self, app=None) -> None:
+        """
+        Connect backend (on_startup signal)
+        :param app: web app
+        :return: None
+        """
+
+    async def stop(self, app=None) -> None:
+        """
+        Disconnect backend (on_cleanup signal)
+        :param app: web app
+        :return: None
+        """
+
+    async def publish(self, room: str, message: bytes) -> None:
+        """
+        Publish message to every worker and save it to the room history
+        :param room: room name
+        :param message: message
+        :return: None
+        """
+        raise NotImplementedError
+
+    async def announce(self, room: str, message: bytes) -> None:
+        """
+        Publish message to every worker without saving it to the room history
+        :param room: room name
+        :param message: message
+        :return: None
+        """
+        raise NotImplementedError
+
+    async def history(self, room: str) -> list:
+        """
+        Get recent messages of the room, oldest first
+        :param room: room name
+        :return: list of messages
+        """
+        raise NotImplementedError
+
+    async def next_seq(self, room: str) -> int:
+        """
+        Get the next sequence number of the room
+        :param room: room name
+        :return: sequence number
+        """
+        raise NotImplementedError
+
+
+class MemoryBackend(BroadcastBackend):
+    """
+    In-process backend, for a single worker.
+    History and counters are kept for the most recently used rooms only,
+    a dropped room continues its sequence from the last saved number.
+    """
+
+    def __init__(
+        self,
+        log,
+        history_size: int = BroadcastValues.HISTORY_SIZE,
+        last_seq=None,
+        max_rooms: int = BroadcastValues.MAX_ROOMS,
+    ):
+        """
+        Init backend
+        :param log: logger to use
+        :param history_size: how many recent messages to keep per room
+        :param last_seq: coroutine function (room) -> last saved sequence number
+        :param max_rooms: max rooms to keep history and counters for
+        """
+        super().__init__(log, history_size, last_seq)
+        self.max_rooms = max_rooms
+        # room -> [recent messages, sequence number or None], LRU order
+        self._rooms = OrderedDict()
+
+    def _room(self, room: str) -> list:
+        """
+        Get state of the room, drop the least recently used room if there are too many
+        :param room: room name
+        :return: [recent messages, sequence number or None]
+        """
+        state = self._rooms.get(room)
+        if state is None:
+            state = self._rooms[room] = [deque(maxlen=self.history_size), None]
+            if len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+        else:
+            self._rooms.move_to_end(room)
+        return state
+
+    async def publish(self, room: str, message: bytes) -> None:
+        self._room(room)[0].append(message)
+        self._deliver(room, message)
+
+    async def announce(self, room: str, message: bytes) -> None:
+        self._deliver(room, message)
+
+    async def history(self, room: str) -> list:
+        state = self._rooms.get(room)
+        return list(state[0]) if state is not None else []
+
+    async def next_seq(self, room: str) -> int:
+        state = self._room(room)
+        if state[1] is None:
+            initial = await self._initial_seq(room)
+            if state[1] is None:
+                state[1] = initial
+        state[1] += 1
+        return state[1]
+
+
+class RedisBackend(BroadcastBackend):
+    """
+    Redis pub/sub backend, for several workers or nodes.
+    Every room is a separate channel "<channel>:<room>", recent history
+    is kept in the shared Redis list "<history_key>:<room>",
+    sequence numbers are shared Redis counters "<seq_key>:<room>".
+    Both expire after the room TTL without messages.
+    """
+
+    def __init__(
+        self,
+        log,
+        history_size: int = BroadcastValues.HISTORY_SIZE,
+        address: str = CacheValues.REDIS_ADDRESS,
+        channel: str = BroadcastValues.REDIS_CHANNEL,
+        history_key: str = BroadcastValues.REDIS_HISTORY_KEY,
+        seq_key: str = BroadcastValues.REDIS_SEQ_KEY,
+        last_seq=None,
+        max_rooms: int = BroadcastValues.MAX_ROOMS,
+        room_ttl: int = BroadcastValues.ROOM_TTL,
+    ):
+        """
+        Init backend with Redis options
+        :param log: logger to use
+        :param history_size: how many recent messages to keep
+        :param address: Redis address
+        :param channel: pub/sub channel prefix
+        :param history_key: history list key prefix
+        :param seq_key: sequence counter key prefix
+        :param last_seq: coroutine function (room) -> last saved sequence number
+        :param max_rooms: max rooms to remember as initialized
+        :param room_ttl: seconds to keep history and counter of a quiet room
+        """
+        super().__init__(log, history_size, last_seq)
+        self.address = address
+        self.channel = channel
+        self.history_key = history_key
+        self.seq_key = seq_key
+        self.room_ttl = room_ttl
+        # Rooms whose Redis counters are known to be initialized, forgotten
+        # before the counter of a quiet room can expire
+        self._sequences = LocalCache(size=max_rooms, ttl=room_ttl / 2)
+        self.redis = None
+        self._subscriber = None
+        self._task = None
+
+    async def start(self, app=None) -> None:
+        self.redis = await aioredis.create_redis_pool(self.address)
+        channel = await self._subscribe()
+        self._task = get_event_loop().create_task(self._listen(channel))
+
+    async def stop(self, app=None) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+        for connection in (self._subscriber, self.redis):
+            if connection is not None:
+                connection.close()
+                await connection.wait_closed()
+
+    async def _subscribe(self):
+        """
+        Subscribe to the room channels
+        :return: subscribed aioredis pattern channel
+        """
+        # Subscribed connection can't run other commands, use a separate one
+        self._subscriber = await aioredis.create_redis(self.address)
+        (channel,) = await self._subscriber.psubscribe(f"{self.channel}:*")
+        return channel
+
+    async def _listen(self, channel) -> None:
+        """
+        Deliver messages from the room channels to the local handlers,
+        resubscribe with backoff if the connection is lost.
+        Messages published meanwhile are missed, clients resume with last_seq.
+        :param channel: subscribed aioredis pattern channel
+        :return: None
+        """
+        prefix = len(self.channel) + 1
+        delay = 1
+        while True:
+            try:
+                if channel is None:
+                    channel = await self._subscribe()
+                    self.log.info("Broadcast channel resubscribed")
+                    delay = 1
+                async for name, message in channel.iter():
+                    try:
+                        self._deliver(name.decode("utf-8")[prefix:], message)
+                    except Exception as error:
+                        self.log.error(f"Failed to deliver broadcast message: {error}")
+                self.log.error("Broadcast channel closed, resubscribe")
+            except CancelledError:
+                raise
+            except Exception as error:
+                self.log.error(f"Broadcast channel error: {error}")
+            if self._subscriber is not None:
+                self._subscriber.close()
+                self._subscriber = None
+            channel = None
+            await sleep(delay)
+            delay = min(delay * 2, 30)
+
+    async def publish(self, room: str, message: bytes) -> None:
+        history_key = f"{self.history_key}:{room}"
+        transaction = self.redis.multi_exec()
+        transaction.lpush(history_key, message)
+        transaction.ltrim(history_key, 0, self.history_size - 1)
+        transaction.expire(history_key, self.room_ttl)
+        transaction.publish(f"{self.channel}:{room}", message)
+        await transaction.execute()
+
+    async def announce(self, room: str, message: bytes) -> None:
+        await self.redis.publish(f"{self.channel}:{room}", message)
+
+    async def history(self, room: str) -> list:
+        messages = await self.redis.lrange(
+            f"{self.history_key}:{room}", 0, self.history_size - 1
+        )
+        return list(reversed(messages))
+
+    async def next_seq(self, room: str) -> int:
+        seq_key = f"{self.seq_key}:{room}"
+        if self._sequences.get(room) is None:
+            # Continue from the database if the counter is lost (Redis restart, TTL)
+            initial = await self._initial_seq(room)
+            await self.redis.set(
+                seq_key,
+                initial,
+                expire=self.room_ttl,
+                exist=self.redis.SET_IF_NOT_EXIST,
+            )
+            self._sequences.set(room, True)
+        transaction = self.redis.multi_exec()
+        transaction.incr(seq_key)
+        transaction.expire(seq_key, self.room_ttl)
+        seq, _ = await transaction.execute()
+        return seq
+
+
+def create_backend(
+    log, name: str = BroadcastValues.BACKEND, last_seq=None
+) -> BroadcastBackend:
+    """
+    Create broadcast backend by name
+    :param log: logger to use
+    :param name: "memory" or "redis"
+    :param last_seq: coroutine function (room) -> last saved sequence number
+    :return: backend
+    """
+    backends = {"memory": MemoryBackend, "redis": RedisBackend}
+    if name not in backends:
+        raise ValueError(f"Unknown broadcast backend: {name}")
+    return backends[name](log, last_seq=last_seq)
@@ -0,0 +1,205 @@
+from asyncio import CancelledError, Event, get_event_loop
+from collections import deque
+from time import monotonic
+
+from aiohttp import WSCloseCode
+
+from chat.utils.config import ClientQueueValues
+from chat.utils.metrics import (
+    CLIENT_FRAMES_COALESCED,
+    CLIENT_FRAMES_DROPPED,
+    CLIENT_SLOW_DISCONNECTS,
+)
+from chat.ws.frames import Frame, send_frame
+
+
+class OverflowPolicy:
+    """
+    Define what to do with a client whose outbound queue is full
+    """
+
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+
+class ClientConnection:
+    """
+    WebSocket connection with its own bounded outbound queue and writer task,
+    so one slow client can't delay delivery to everybody else
+    """
+
+    def __init__(
+        self,
+        websocket,
+        username: str,
+        log,
+        user_id: int = None,
+        queue_size: int = ClientQueueValues.QUEUE_SIZE,
+        policy: str = ClientQueueValues.OVERFLOW_POLICY,
+    ):
+        """
+        Init connection
+        :param websocket: prepared WebSocketResponse
+        :param username: username of the connection owner
+        :param log: logger to use
+        :param user_id: user_id of the connection owner
+        :param queue_size: max pending messages
+        :param policy: overflow policy (see OverflowPolicy)
+        """
+        self.websocket = websocket
+        self.username = username
+        self.user_id = user_id
+        self.log = log
+        self.queue_size = queue_size
+        self.policy = policy
+        self.queue = deque()
+        self.rooms = set()
+        # Time of the last message from the client
+        self.last_seen = monotonic()
+        # Closed by the reaper, not to be counted again
+        self.reaped = False
+        # Frames held back while the session is being resumed
+        self.held = None
+        self._ready = Event()
+        self._drained = Event()
+        self._drained.set()
+        self._task = None
+        self._closing = False
+
+    @property
+    def depth(self) -> int:
+        """
+        Current outbound queue depth
+        :return: number of pending messages
+        """
+        return len(self.queue)
+
+    @property
+    def closed(self) -> bool:
+        """
+        Connection is closed or its writer has failed
+        :return: True if no more messages can be sent
+        """
+        return self._closing or self.websocket.closed
+
+    def start(self) -> None:
+        """
+        Start writer task
+        :return: None
+        """
+        self._task = get_event_loop().create_task(self._write())
+
+    async def close(self) -> None:
+        """
+        Stop writer task, pending messages are discarded
+        :return: None
+        """
+        self._closing = True
+        self.queue.clear()
+        self._drained.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+            self._task = None
+
+    async def drain(self) -> None:
+        """
+        Wait until all pending messages are written
+        :return: None
+        """
+        if self._task is not None and not self._closing:
+            await self._drained.wait()
+
+    def hold(self) -> None:
+        """
+        Hold back new frames until release()
+        :return: None
+        """
+        self.held = []
+
+    def release(self) -> list:
+        """
+        Stop holding frames back
+        :return: held frames, the caller decides which ones to send
+        """
+        held, self.held = self.held or [], None
+        return held
+
+    def send(self, frame: Frame) -> bool:
+        """
+        Enqueue frame without waiting, apply overflow policy if the queue is full
+        :param frame: pre-built frame, shared between clients
+        :return: True if enqueued, False if the client is being disconnected
+        """
+        if self._closing:
+            return False
+        if self.held is not None:
+            self.held.append(frame)
+            return True
+        if len(self.queue) >= self.queue_size:
+            if self.policy == OverflowPolicy.DISCONNECT:
+                self._disconnect()
+                return False
+            elif self.policy == OverflowPolicy.COALESCE:
+                self._coalesce()
+            else:
+                self.queue.popleft()
+                CLIENT_FRAMES_DROPPED.inc()
+        self.queue.append(frame)
+        self._drained.clear()
+        self._ready.set()
+        return True
+
+    def _coalesce(self) -> None:
+        """
+        Merge all pending messages into one JSON array frame
+        :return: None
+        """
+        merged = Frame.merge(self.queue)
+        CLIENT_FRAMES_COALESCED.inc(len(self.queue))
+        self.queue.clear()
+        self.queue.append(merged)
+
+    def _disconnect(self) -> None:
+        """
+        Drop slow client
+        :return: None
+        """
+        self.log.warning(f"Disconnect slow client {self.username}")
+        self._closing = True
+        CLIENT_FRAMES_DROPPED.inc(len(self.queue))
+        CLIENT_SLOW_DISCONNECTS.inc()
+        self.queue.clear()
+        if self._task is not None:
+            self._task.cancel()
+        get_event_loop().create_task(
+            self.websocket.close(
+                code=WSCloseCode.TRY_AGAIN_LATER, message=b"Slow consumer"
+            )
+        )
+
+    async def _write(self) -> None:
+        """
+        Send pending messages one by one
+        :return: None
+        """
+        while True:
+            await self._ready.wait()
+            while self.queue:
+                frame = self.queue.popleft()
+                try:
+                    await send_frame(self.websocket, frame)
+                except (ConnectionError, RuntimeError) as error:
+                    self.log.error(f"Failed to send to {self.username}: {error}")
+                    self._closing = True
+                    self.queue.clear()
+                    self._drained.set()
+                    return
+                if frame.on_sent is not None:
+                    frame.on_sent()
+            self._ready.clear()
+            self._drained.set()
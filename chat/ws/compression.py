@@ -0,0 +1,70 @@
+import zlib
+
+from aiohttp import hdrs, web
+from aiohttp.http_websocket import ws_ext_gen
+
+from chat.utils.config import CompressionValues
+
+# Every compressed message ends with it, and it's removed before sending
+DEFLATE_TRAILING = b"\x00\x00\xff\xff"
+
+
+def deflate(payload: bytes, wbits: int, level: int = CompressionValues.LEVEL) -> bytes:
+    """
+    Compress payload as one independent permessage-deflate message
+    (no back-references to previous messages)
+    :param payload: payload to compress
+    :param wbits: negotiated window bits
+    :param level: zlib compression level
+    :return: compressed payload
+    """
+    compressobj = zlib.compressobj(level, zlib.DEFLATED, -wbits)
+    data = compressobj.compress(payload) + compressobj.flush(zlib.Z_SYNC_FLUSH)
+    if data.endswith(DEFLATE_TRAILING):
+        data = data[:-4]
+    return data
+
+
+class WebSocketResponse(web.WebSocketResponse):
+    """
+    WebSocket response with configurable permessage-deflate.
+    In shared mode the server always answers with "server_no_context_takeover",
+    so the same compressed broadcast frame is valid for every client.
+    """
+
+    def __init__(
+        self,
+        *,
+        compress: bool = CompressionValues.ENABLED,
+        shared: bool = CompressionValues.SHARED,
+        level: int = CompressionValues.LEVEL,
+        **kwargs,
+    ):
+        """
+        Init response
+        :param compress: enable permessage-deflate if the client supports it
+        :param shared: force server_no_context_takeover
+        :param level: zlib compression level
+        :param kwargs: WebSocketResponse kwargs
+        """
+        super().__init__(compress=compress, **kwargs)
+        self.shared = shared
+        self.level = level
+
+    def _handshake(self, request):
+        headers, protocol, compress, notakeover = super()._handshake(request)
+        if compress and self.shared and not notakeover:
+            headers[hdrs.SEC_WEBSOCKET_EXTENSIONS] = ws_ext_gen(
+                compress=compress, isserver=True, server_notakeover=True
+            )
+            notakeover = True
+        return headers, protocol, compress, notakeover
+
+    async def prepare(self, request):
+        payload_writer = await super().prepare(request)
+        if self._writer.compress:
+            # aiohttp creates the compressor lazily with the default level
+            self._writer._compressobj = zlib.compressobj(
+                self.level, zlib.DEFLATED, -self._writer.compress
+            )
+        return payload_writer
@@ -0,0 +1,116 @@
+from struct import Struct
+
+from aiohttp import WSMsgType
+
+from chat.utils.config import CompressionValues
+from chat.ws.compression import deflate
+
+PACK_LEN1 = Struct("!BB").pack
+PACK_LEN2 = Struct("!BBH").pack
+PACK_LEN3 = Struct("!BBQ").pack
+
+# Server frames are never masked, FIN bit is always set
+FIN = 0x80
+# Compressed message bit of permessage-deflate
+RSV1 = 0x40
+
+
+class Frame:
+    """
+    WebSocket text frame built once and written as is to every client.
+    Compressed variants are built on first use and shared too.
+    on_sent is called every time the frame is written to a client.
+    """
+
+    __slots__ = ("payload", "data", "on_sent", "_compressed")
+
+    def __init__(self, payload: bytes, on_sent=None):
+        """
+        Build frame header and frame bytes
+        :param payload: UTF-8 encoded JSON
+        :param on_sent: callable without arguments, or None
+        """
+        self.payload = payload
+        self.data = header(len(payload), WSMsgType.TEXT) + payload
+        self.on_sent = on_sent
+        self._compressed = None
+
+    def compressed(self, wbits: int) -> bytes:
+        """
+        Get compressed frame for the negotiated window bits
+        :param wbits: window bits
+        :return: frame bytes
+        """
+        if self._compressed is None:
+            self._compressed = {}
+        data = self._compressed.get(wbits)
+        if data is None:
+            payload = deflate(self.payload, wbits)
+            data = header(len(payload), WSMsgType.TEXT, RSV1) + payload
+            self._compressed[wbits] = data
+        return data
+
+    @staticmethod
+    def merge(frames) -> "Frame":
+        """
+        Merge several JSON frames into one flat JSON array frame,
+        on_sent callbacks of the frames are kept
+        :param frames: frames with JSON objects or arrays of them
+        :return: new frame
+        """
+        parts = (
+            frame.payload[1:-1] if frame.payload[:1] == b"[" else frame.payload
+            for frame in frames
+        )
+        callbacks = [frame.on_sent for frame in frames if frame.on_sent is not None]
+
+        def on_sent():
+            for callback in callbacks:
+                callback()
+
+        return Frame(b"[" + b",".join(parts) + b"]", on_sent if callbacks else None)
+
+
+def header(length: int, opcode: int, rsv: int = 0) -> bytes:
+    """
+    Build server-side frame header
+    :param length: payload length
+    :param opcode: frame opcode
+    :param rsv: RSV bits (RSV1 for compressed messages)
+    :return: header bytes
+    """
+    if length < 126:
+        return PACK_LEN1(FIN | rsv | opcode, length)
+    elif length < (1 << 16):
+        return PACK_LEN2(FIN | rsv | opcode, 126, length)
+    return PACK_LEN3(FIN | rsv | opcode, 127, length)
+
+
+async def send_frame(
+    websocket, frame: Frame, threshold: int = CompressionValues.THRESHOLD
+) -> None:
+    """
+    Write pre-built frame to the client transport, bypassing per-client
+    encoding and framing, with the same flow control as aiohttp writer.
+    Clients with compression context takeover need their own compressor,
+    so their frames are compressed by aiohttp writer.
+    :param websocket: prepared WebSocketResponse
+    :param frame: frame to send
+    :param threshold: smaller payloads are sent uncompressed
+    :return: None
+    """
+    writer = websocket._writer
+    if websocket.closed or writer is None or writer.transport.is_closing():
+        raise ConnectionResetError("Cannot write to closing transport")
+    if writer.compress and len(frame.payload) >= threshold:
+        if not writer.notakeover:
+            await writer.send(frame.payload)
+            return
+        data = frame.compressed(writer.compress)
+    else:
+        data = frame.data
+    writer.transport.write(data)
+    writer._output_size += len(data)
+    if writer._output_size > writer._limit:
+        writer._output_size = 0
+        await writer.protocol._drain_helper()
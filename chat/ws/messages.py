@@ -0,0 +1,48 @@
+from datetime import datetime
+
+
+def chat_message(
+    username: str, message: str, date_time: datetime, room: str, seq: int = None
+) -> dict:
+    """
+    Represent chat message the way clients expect it
+    :param username: username of the sender
+    :param message: message content
+    :param date_time: date and time of the message
+    :param room: room name
+    :param seq: sequence number of the message in the room (None for server messages)
+    :return: message dict
+    """
+    return {
+        "user": username,
+        "message": message,
+        "time": f"{date_time:%H:%M:%S}",
+        "room": room,
+        "seq": seq,
+    }
+
+
+def direct_message(
+    username: str,
+    recipient: str,
+    message: str,
+    date_time: datetime,
+    message_id: int = None,
+) -> dict:
+    """
+    Represent direct message the way clients expect it
+    :param username: username of the sender
+    :param recipient: username of the recipient
+    :param message: message content
+    :param date_time: date and time of the message
+    :param message_id: inbox id of the message (None in the sender's copy)
+    :return: message dict
+    """
+    return {
+        "type": "direct",
+        "id": message_id,
+        "user": username,
+        "to": recipient,
+        "message": message,
+        "time": f"{date_time:%H:%M:%S}",
+    }
@@ -0,0 +1,250 @@
+import os
+from asyncio import CancelledError, get_event_loop, sleep
+from time import time
+from uuid import uuid4
+
+from chat.utils.codec import dumps
+from chat.utils.config import PresenceValues, RoomValues
+
+# Apply local connection counts of the worker and return users that became
+# online or offline for the whole cluster (not connected to other live workers).
+# Users of workers that stopped updating are offline too, unless connected
+# elsewhere, their hashes are removed. The scripts read the hashes of other
+# workers, which can't be declared in KEYS: a single Redis node is required
+# (not Redis Cluster).
+# KEYS[1] - live workers sorted set (score - expiration time),
+# KEYS[2] - hash username -> connections of this worker
+# ARGV - key prefix, worker id, now, TTL, then username, count pairs
+# Returns joined, left and 1 if this worker itself had expired
+# (other workers could have removed its hash, it has to be written again)
+PRESENCE_SCRIPT = """
+local prefix, worker = ARGV[1], ARGV[2]
+local now, ttl = tonumber(ARGV[3]), tonumber(ARGV[4])
+local score = tonumber(redis.call("ZSCORE", KEYS[1], worker))
+local expired = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", now)
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now)
+redis.call("ZADD", KEYS[1], now + ttl, worker)
+local workers = redis.call("ZRANGE", KEYS[1], 0, -1)
+local function connected(user, except)
+    for _, other in ipairs(workers) do
+        if other ~= except and redis.call("HEXISTS", prefix .. other, user) == 1 then
+            return true
+        end
+    end
+    return false
+end
+local joined, left, seen = {}, {}, {}
+for i = 5, #ARGV, 2 do
+    local user, count = ARGV[i], tonumber(ARGV[i + 1])
+    local elsewhere = connected(user, worker)
+    if count > 0 then
+        if redis.call("HSET", KEYS[2], user, count) == 1 and not elsewhere then
+            table.insert(joined, user)
+        end
+    elseif redis.call("HDEL", KEYS[2], user) == 1 and not elsewhere then
+        table.insert(left, user)
+        seen[user] = true
+    end
+end
+for _, gone in ipairs(expired) do
+    if gone ~= worker then
+        for _, user in ipairs(redis.call("HKEYS", prefix .. gone)) do
+            if not seen[user] and not connected(user, nil) then
+                table.insert(left, user)
+                seen[user] = true
+            end
+        end
+        redis.call("DEL", prefix .. gone)
+    end
+end
+-- Outlive the sorted set entry, so the users can be read after it expires
+redis.call("EXPIRE", KEYS[2], math.ceil(ttl) * 2)
+local reset = 0
+if not score or score <= now then
+    reset = 1
+end
+return {joined, left, reset}
+"""
+
+# Users connected to any live worker (single Redis node, see above).
+# KEYS[1] - live workers sorted set, ARGV - key prefix, now
+ONLINE_SCRIPT = """
+local users, seen = {}, {}
+for _, worker in ipairs(redis.call("ZRANGEBYSCORE", KEYS[1], ARGV[2], "+inf")) do
+    for _, user in ipairs(redis.call("HKEYS", ARGV[1] .. worker)) do
+        if not seen[user] then
+            seen[user] = true
+            table.insert(users, user)
+        end
+    end
+end
+return users
+"""
+
+
+class PresenceService:
+    """
+    Track online users and notify clients about changes in batches.
+    Connects and disconnects are collected and sent to the default room
+    as one diff per interval: {"type": "presence", "joined": [...], "left": [...]},
+    so a reconnect storm produces a few frames instead of a message per socket.
+    Diffs are not part of the room history and are never saved.
+    With a Redis cache the online users of all workers are shared in Redis.
+    """
+
+    def __init__(
+        self,
+        log,
+        backend,
+        cache=None,
+        interval: float = PresenceValues.INTERVAL,
+        ttl: float = PresenceValues.TTL,
+        prefix: str = PresenceValues.REDIS_KEY,
+    ):
+        """
+        Init service
+        :param log: logger to use
+        :param backend: broadcast backend to send diffs with
+        :param cache: RedisCache to share online users between workers, or None
+        :param interval: seconds between diffs
+        :param ttl: seconds to keep online users of a worker that stopped updating
+        :param prefix: Redis key prefix
+        """
+        self.log = log
+        self.backend = backend
+        self.cache = cache
+        self.interval = interval
+        self.ttl = ttl
+        self.prefix = prefix
+        self.worker = f"{os.getpid()}-{uuid4().hex[:8]}"
+        # Users announced as online by this worker
+        self.online_users = set()
+        # username -> current number of local connections, since the last diff
+        self._pending = {}
+        self._task = None
+
+    def update(self, username: str, connections: int) -> None:
+        """
+        Record the number of local connections of the user after connect/disconnect
+        :param username: username
+        :param connections: number of connections of the user on this worker
+        :return: None
+        """
+        self._pending[username] = connections
+
+    async def start(self, app=None) -> None:
+        """
+        Start sending diffs (on_startup signal)
+        :param app: web app
+        :return: None
+        """
+        self._task = get_event_loop().create_task(self._run())
+
+    async def stop(self, app=None) -> None:
+        """
+        Stop sending diffs (on_cleanup signal), the last diff tells
+        the other workers about users that left with this worker
+        :param app: web app
+        :return: None
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+            self._task = None
+        for username in self.online_users:
+            self._pending.setdefault(username, 0)
+        try:
+            await self.flush()
+        except Exception as error:
+            self.log.error(f"Failed to send the last presence diff: {error}")
+
+    async def _run(self) -> None:
+        while True:
+            await sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as error:
+                self.log.error(f"Failed to send presence diff: {error}")
+
+    async def flush(self) -> None:
+        """
+        Apply pending changes and send the diff if anybody joined or left
+        :return: None
+        """
+        pending, self._pending = self._pending, {}
+        if self.cache is not None:
+            joined, left = await self._apply_shared(pending)
+        elif pending:
+            joined, left = self._apply_local(pending)
+        else:
+            return
+        if joined or left:
+            message = {
+                "type": "presence",
+                "room": RoomValues.DEFAULT_ROOM,
+                "joined": sorted(joined),
+                "left": sorted(left),
+            }
+            await self.backend.announce(RoomValues.DEFAULT_ROOM, dumps(message))
+
+    def _apply_local(self, pending: dict) -> tuple:
+        """
+        Find users that became online or offline on this worker
+        :param pending: username -> number of local connections
+        :return: (joined, left) lists of usernames
+        """
+        joined, left = [], []
+        for username, connections in pending.items():
+            if connections and username not in self.online_users:
+                self.online_users.add(username)
+                joined.append(username)
+            elif not connections and username in self.online_users:
+                self.online_users.discard(username)
+                left.append(username)
+        return joined, left
+
+    async def _apply_shared(self, pending: dict) -> tuple:
+        """
+        Save local connection counts to Redis (also every interval without
+        changes, to keep this worker alive) and find users that became online
+        or offline for all workers
+        :param pending: username -> number of local connections
+        :return: (joined, left) lists of usernames
+        """
+        self._apply_local(pending)
+        joined, left, reset = await self._eval_presence(pending)
+        if reset and self.online_users:
+            # New or expired worker: other workers may have announced
+            # its users as left, write all of them again
+            rejoined, _, _ = await self._eval_presence(
+                {username: 1 for username in self.online_users}
+            )
+            joined = list(set(joined) | set(rejoined))
+        return joined, left
+
+    async def _eval_presence(self, pending: dict) -> list:
+        args = [f"{self.prefix}:", self.worker, time(), self.ttl]
+        for username, connections in pending.items():
+            args.extend((username, connections))
+        return await self.cache.eval(
+            PRESENCE_SCRIPT,
+            keys=[f"{self.prefix}:workers", f"{self.prefix}:{self.worker}"],
+            args=args,
+        )
+
+    async def online(self) -> list:
+        """
+        Get online users (of all workers with a Redis cache)
+        :return: sorted list of usernames
+        """
+        if self.cache is None:
+            return sorted(self.online_users)
+        users = await self.cache.eval(
+            ONLINE_SCRIPT,
+            keys=[f"{self.prefix}:workers"],
+            args=[f"{self.prefix}:", time()],
+        )
+        return sorted(users)
@@ -0,0 +1,82 @@
+from chat.utils.config import RegistryValues
+
+
+class ConnectionRegistry:
+    """
+    Connected clients of this worker: O(1) add/remove, username -> connections
+    index (one user may have several tabs) and shards, so operations over all
+    connections can be split into parts and yield to the event loop between them
+    """
+
+    def __init__(self, shards: int = RegistryValues.SHARDS):
+        """
+        Init empty registry
+        :param shards: number of shards
+        """
+        self.shards = [set() for _ in range(max(1, shards))]
+        # connection -> its shard
+        self._shard_of = {}
+        self._users = {}
+        self._next_shard = 0
+
+    def __len__(self) -> int:
+        return len(self._shard_of)
+
+    def __iter__(self):
+        return iter(list(self._shard_of))
+
+    def __contains__(self, client) -> bool:
+        return client in self._shard_of
+
+    def add(self, client) -> None:
+        """
+        Register connection, shards are filled round-robin
+        :param client: connection (ClientConnection)
+        :return: None
+        """
+        if client in self._shard_of:
+            return
+        shard = self.shards[self._next_shard]
+        self._next_shard = (self._next_shard + 1) % len(self.shards)
+        shard.add(client)
+        self._shard_of[client] = shard
+        self._users.setdefault(client.username, set()).add(client)
+
+    def remove(self, client) -> None:
+        """
+        Unregister connection, forget users without connections
+        :param client: connection (ClientConnection)
+        :return: None
+        """
+        shard = self._shard_of.pop(client, None)
+        if shard is None:
+            return
+        shard.discard(client)
+        connections = self._users.get(client.username)
+        if connections is not None:
+            connections.discard(client)
+            if not connections:
+                del self._users[client.username]
+
+    def user(self, username: str) -> set:
+        """
+        Get connections of the user
+        :param username: username
+        :return: set of connections
+        """
+        return self._users.get(username, set())
+
+    def users(self) -> list:
+        """
+        Get users with at least one connection
+        :return: list of usernames
+        """
+        return list(self._users)
+
+    def online(self, username: str) -> bool:
+        """
+        Check if the user has at least one connection
+        :param username: username
+        :return: True or False
+        """
+        return username in self._users
@@ -0,0 +1,83 @@
+from re import compile
+
+from chat.utils.config import RoomValues
+
+room_name = compile(RoomValues.NAME_REGEX)
+
+
+def valid_room(room) -> bool:
+    """
+    Check room name
+    :param room: room name
+    :return: True or False
+    """
+    return isinstance(room, str) and bool(room_name.match(room))
+
+
+class RoomIndex:
+    """
+    Index room -> subscribed connections, so sending to a room
+    touches only the sockets of that room
+    """
+
+    def __init__(self, max_rooms: int = RoomValues.MAX_ROOMS_PER_CLIENT):
+        """
+        Init empty index
+        :param max_rooms: max rooms per one connection
+        """
+        self.max_rooms = max_rooms
+        self._subscribers = {}
+
+    def join(self, room: str, client) -> bool:
+        """
+        Subscribe connection to the room
+        :param room: room name
+        :param client: connection (ClientConnection)
+        :return: True if joined, False if the room limit is reached
+        """
+        if room in client.rooms:
+            return True
+        if len(client.rooms) >= self.max_rooms:
+            return False
+        self._subscribers.setdefault(room, set()).add(client)
+        client.rooms.add(room)
+        return True
+
+    def leave(self, room: str, client) -> None:
+        """
+        Unsubscribe connection from the room, forget empty rooms
+        :param room: room name
+        :param client: connection (ClientConnection)
+        :return: None
+        """
+        client.rooms.discard(room)
+        subscribers = self._subscribers.get(room)
+        if subscribers is None:
+            return
+        subscribers.discard(client)
+        if not subscribers:
+            del self._subscribers[room]
+
+    def leave_all(self, client) -> None:
+        """
+        Unsubscribe connection from every room
+        :param client: connection (ClientConnection)
+        :return: None
+        """
+        for room in list(client.rooms):
+            self.leave(room, client)
+
+    def subscribers(self, room: str) -> set:
+        """
+        Get connections subscribed to the room
+        :param room: room name
+        :return: set of connections
+        """
+        return self._subscribers.get(room, set())
+
+    def rooms(self) -> list:
+        """
+        Get rooms with at least one local subscriber
+        :return: list of room names
+        """
+        return list(self._subscribers)